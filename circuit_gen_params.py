@@ -1,9 +1,54 @@
+import copy
+import numpy as np
+import stim
+
+
+def append_qubit_instruction(circuit, name, targets, p=None):
+    # circuit.append(name, targets, p) for qubit targets. Parsing the instruction is much faster than appending a
+    # long Python list of targets.
+    arg = "" if p is None else "(%r)" % float(p)
+    circuit += stim.Circuit("%s%s %s" % (name, arg, " ".join(map(str, targets))))
+
+
 def append_anti_basis_error(circuit, targets, p, basis):
     if p > 0:
         if basis == "X":
-            circuit.append("Z_ERROR", targets, p)
+            append_qubit_instruction(circuit, "Z_ERROR", targets, p)
         else:
-            circuit.append("X_ERROR", targets, p)
+            append_qubit_instruction(circuit, "X_ERROR", targets, p)
+
+
+def qubit_rate_array(logical_qubit, rates):
+    # Array of the error rates {coord: p} indexed by the qubit indices of logical_qubit, nan for the other qubits
+    indices = dict(zip(logical_qubit.qubit_table.ids(rates.keys()), rates.values()))
+    array = np.full(max(indices, default=-1) + 1, np.nan)
+    array[list(indices.keys())] = list(indices.values())
+    return array
+
+
+class BurstEvent:
+    # Burst of errors on the qubits hit by burst_error(center, radius), starting at round start (the first round is
+    # 0). profile[k] is their depolarization k rounds after start; the burst is over once profile runs out.
+    def __init__(self, center, radius, start, profile):
+        self.center = center
+        self.radius = radius
+        self.start = start
+        self.profile = list(profile)
+
+    def rate(self, round_index):
+        k = round_index - self.start
+        return self.profile[k] if 0 <= k < len(self.profile) else 0
+
+
+def exponential_profile(p, rounds, base, step=2):
+    # Profile of a burst of depolarization p decaying like exp(-k / rounds) after k rounds, until it reaches the rate
+    # base of the circuit it is added to. It is a staircase dropping by a factor step at a time, so that the circuit
+    # only needs one REPEAT block per stair.
+    profile = []
+    while p > base:
+        profile += [p] * max(1, round(rounds * np.log(step)))
+        p /= step
+    return profile
 
 
 class CircuitGenParameters:
@@ -13,7 +58,9 @@ class CircuitGenParameters:
         after_clifford_depolarization=0,
         before_round_data_depolarization=0,
         before_measure_flip_probability=0,
-        after_reset_flip_probability=0
+        after_reset_flip_probability=0,
+        qubit_depolarization=None,
+        pair_depolarization=None
     ):
         self.rounds = rounds
         self.after_clifford_depolarization = after_clifford_depolarization
@@ -21,65 +68,93 @@ class CircuitGenParameters:
         self.before_measure_flip_probability = before_measure_flip_probability
         self.after_reset_flip_probability = after_reset_flip_probability
         self.burst_errors_depolarization = 0.5
+        # qubit_depolarization[q] raises the depolarization of the gates on qubit q and of q before rounds to at least
+        # that rate (nan keeps it), see qubit_rate_array(). A two-qubit gate takes the larger rate of its qubits, and
+        # pair_depolarization[(q1, q2)] replaces the rate of the gates on q1 and q2.
+        self.qubit_depolarization = None if qubit_depolarization is None else np.asarray(qubit_depolarization, float)
+        self.pair_depolarization = {tuple(sorted(pair)): p for pair, p in (pair_depolarization or {}).items()}
+        # noise instructions of the target lists seen so far, keyed by the targets and the scalar rates. The rate maps
+        # are fixed once the parameters are made.
+        self._noise_layers = {}
+
+    def with_qubit_depolarization(self, rates):
+        # Copy of the parameters where the qubits of the array rates (nan for none) take the larger of their rate in
+        # rates and in qubit_depolarization
+        other = copy.copy(self)
+        if self.qubit_depolarization is not None:
+            size = max(len(rates), len(self.qubit_depolarization))
+            rates = np.fmax(np.pad(rates, (0, size - len(rates)), constant_values=np.nan),
+                            np.pad(self.qubit_depolarization, (0, size - len(self.qubit_depolarization)),
+                                   constant_values=np.nan))
+        other.qubit_depolarization = np.asarray(rates, float)
+        other._noise_layers = {}
+        return other
 
     def append_begin_round_tick(self, circuit, data_qubits, ano_qubits):
         circuit.append("TICK")
-        if self.before_round_data_depolarization > 0:
-            norm_targets = []
-            ano_targets = []
-            for q in data_qubits:
-                if q in ano_qubits:
-                    ano_targets.append(q)
-                else:
-                    norm_targets.append(q)
-            if norm_targets:
-                circuit.append("DEPOLARIZE1", norm_targets, self.before_round_data_depolarization)
-            if ano_targets:
-                circuit.append("DEPOLARIZE1", ano_targets, self.burst_errors_depolarization)
+        circuit += self._noise_layer("DEPOLARIZE1", data_qubits, ano_qubits, self.before_round_data_depolarization)
 
     def append_unitary_1(self, circuit, name, targets, ano_qubits):
-        circuit.append(name, targets)
-        if self.after_clifford_depolarization > 0:
-            norm_targets = []
-            ano_targets = []
-            for q in targets:
-                if q in ano_qubits:
-                    ano_targets.append(q)
-                else:
-                    norm_targets.append(q)
-            if norm_targets:
-                circuit.append("DEPOLARIZE1", norm_targets, self.after_clifford_depolarization)
-            if ano_targets:
-                circuit.append("DEPOLARIZE1", ano_targets, self.burst_errors_depolarization)
+        append_qubit_instruction(circuit, name, targets)
+        circuit += self._noise_layer("DEPOLARIZE1", targets, ano_qubits, self.after_clifford_depolarization)
 
     def append_unitary_2(self, circuit, name, targets, ano_qubits):
-        circuit.append(name, targets)
-        if self.after_clifford_depolarization > 0:
-            norm_targets = []
-            ano_targets = []
-            for i in range(0, len(targets), 2):
-                if targets[i] in ano_qubits or targets[i+1] in ano_qubits:
-                    ano_targets.extend(targets[i:i+2])
-                else:
-                    norm_targets.extend(targets[i:i+2])
-            if norm_targets:
-                circuit.append("DEPOLARIZE2", norm_targets, self.after_clifford_depolarization)
-            if ano_targets:
-                circuit.append("DEPOLARIZE2", ano_targets, self.burst_errors_depolarization)
+        append_qubit_instruction(circuit, name, targets)
+        circuit += self._noise_layer("DEPOLARIZE2", targets, ano_qubits, self.after_clifford_depolarization)
+
+    def _noise_layer(self, name, targets, ano_qubits, p):
+        # Circuit of the noise after a layer of gates on targets. Each gate has rate p, burst_errors_depolarization
+        # if it touches ano_qubits, raised to its rate from qubit_depolarization if that is larger, or its rate from
+        # pair_depolarization. The gates are grouped into one instruction per rate, those at p first and then the
+        # burst ones like the uniform model always did, and the result is kept for the next rounds.
+        if not isinstance(ano_qubits, frozenset):
+            ano_qubits = frozenset(ano_qubits)
+        key = (name, tuple(targets), ano_qubits, p, self.burst_errors_depolarization)
+        if key not in self._noise_layers:
+            arity = 2 if name == "DEPOLARIZE2" else 1
+            gates = np.array(targets, dtype=np.int64).reshape(-1, arity)
+            gate_rates = np.full(len(gates), np.nan)
+            # 0 for the gates at rate p, 1 for those at burst_errors_depolarization, 2 for those with their own rate
+            sources = np.zeros(len(gates), dtype=np.int64)
+            if p > 0:
+                gate_rates[:] = p
+                sources[np.isin(gates, list(ano_qubits)).any(axis=1)] = 1
+                gate_rates[sources == 1] = self.burst_errors_depolarization
+            if self.qubit_depolarization is not None and len(gates):
+                inside = gates < len(self.qubit_depolarization)
+                qubit_rates = np.where(inside, self.qubit_depolarization[np.where(inside, gates, 0)], np.nan)
+                qubit_rates = np.fmax.reduce(qubit_rates, axis=1)
+                raised = np.fmax(gate_rates, qubit_rates)
+                sources[raised != gate_rates] = 2
+                gate_rates = raised
+            if arity == 2 and self.pair_depolarization:
+                for i, pair in enumerate(gates.tolist()):
+                    if tuple(sorted(pair)) in self.pair_depolarization:
+                        gate_rates[i] = self.pair_depolarization[tuple(sorted(pair))]
+                        sources[i] = 2
+            groups = {(0, float(p)): [], (1, float(self.burst_errors_depolarization)): []}
+            for gate, rate, source in zip(gates.tolist(), gate_rates.tolist(), sources.tolist()):
+                if not np.isnan(rate):
+                    groups.setdefault((source, rate), []).extend(gate)
+            # parsed at once like in append_qubit_instruction()
+            text = "\n".join("%s(%r) %s" % (name, rate, " ".join(map(str, group)))
+                              for (source, rate), group in groups.items() if group)
+            self._noise_layers[key] = stim.Circuit(text)
+        return self._noise_layers[key]
 
     def append_reset(self, circuit, targets, basis="Z"):
         gate = "R" + basis
-        circuit.append(gate, targets)
+        append_qubit_instruction(circuit, gate, targets)
         append_anti_basis_error(circuit, targets, self.after_reset_flip_probability, basis)
 
     def append_measure(self, circuit, targets, basis="Z"):
         gate = "M" + basis
         append_anti_basis_error(circuit, targets, self.before_measure_flip_probability, basis)
-        circuit.append(gate, targets)
+        append_qubit_instruction(circuit, gate, targets)
 
     def append_measure_reset(self, circuit, targets, basis="Z"):
         gate = "MR" + basis
         append_anti_basis_error(circuit, targets, self.before_measure_flip_probability, basis)
-        circuit.append(gate, targets)
+        append_qubit_instruction(circuit, gate, targets)
         append_anti_basis_error(circuit, targets, self.after_reset_flip_probability, basis)
 
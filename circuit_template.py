@@ -0,0 +1,78 @@
+from circuit_gen_params import CircuitGenParameters
+from gen_surface_code_ver3 import generate_surface_code_circuit
+import stim
+
+# Placeholder probability of each noise channel in a template: (parameter giving the probability, parameter that
+# must be > 0 for the instruction to exist)
+PLACEHOLDERS = {
+    0.01: ("after_clifford_depolarization", "after_clifford_depolarization"),
+    0.02: ("before_round_data_depolarization", "before_round_data_depolarization"),
+    0.03: ("before_measure_flip_probability", "before_measure_flip_probability"),
+    0.04: ("after_reset_flip_probability", "after_reset_flip_probability"),
+    0.05: ("burst_errors_depolarization", "after_clifford_depolarization"),
+    0.06: ("burst_errors_depolarization", "before_round_data_depolarization"),
+}
+NOISE_GATES = {"DEPOLARIZE1", "DEPOLARIZE2", "X_ERROR", "Z_ERROR"}
+
+
+class _PlaceholderParameters(CircuitGenParameters):
+    # Parameters emitting every noise instruction with the placeholder probability of its channel
+    def __init__(self, rounds):
+        super().__init__(rounds, 0.01, 0.02, 0.03, 0.04)
+        self.burst_errors_depolarization = 0.05
+
+    def append_begin_round_tick(self, circuit, data_qubits, ano_qubits):
+        # the burst errors at the start of a round depend on before_round_data_depolarization, not on
+        # after_clifford_depolarization like those after the gates
+        self.burst_errors_depolarization = 0.06
+        super().append_begin_round_tick(circuit, data_qubits, ano_qubits)
+        self.burst_errors_depolarization = 0.05
+
+
+class CircuitTemplate:
+    # Structure of the unshelled memory circuit of a patch, generated once. circuit(params) fills in the noise of
+    # params, giving the same circuit as generate_surface_code_circuit(params, logical_qubit, False, is_memory_z)
+    # without generating it again.
+    def __init__(self, logical_qubit, rounds, is_memory_z):
+        self.rounds = rounds
+        self.is_memory_z = is_memory_z
+        circuit = generate_surface_code_circuit(_PlaceholderParameters(rounds), logical_qubit, False, is_memory_z)
+        self.items = self._split(circuit)
+
+    def circuit(self, params):
+        if params.rounds != self.rounds:
+            raise ValueError("Template of %d rounds, got parameters of %d rounds." % (self.rounds, params.rounds))
+        if params.qubit_depolarization is not None or params.pair_depolarization:
+            raise ValueError("Templates only support the uniform noise model.")
+        return self._build(self.items, params)
+
+    def _split(self, circuit):
+        # [(None, circuit)] for the runs of noiseless instructions, [(name, targets, parameter, gate_parameter)] for
+        # the noise, targets being the text of the qubit indices, and [("REPEAT", repeat_count, items)] for the
+        # repeated blocks
+        items = []
+        for instruction in circuit:
+            if isinstance(instruction, stim.CircuitRepeatBlock):
+                items.append(("REPEAT", instruction.repeat_count, self._split(instruction.body_copy())))
+            elif instruction.name in NOISE_GATES:
+                parameter, gate_parameter = PLACEHOLDERS[instruction.gate_args_copy()[0]]
+                targets = " ".join(str(target.value) for target in instruction.targets_copy())
+                items.append((instruction.name, targets, parameter, gate_parameter))
+            else:
+                if not items or items[-1][0] is not None:
+                    items.append((None, stim.Circuit()))
+                items[-1][1].append(instruction)
+        return items
+
+    def _build(self, items, params):
+        # appending piece by piece merges neighboring instructions exactly as the generator does
+        circuit = stim.Circuit()
+        for item in items:
+            if item[0] is None:
+                circuit += item[1]
+            elif item[0] == "REPEAT":
+                circuit.append(stim.CircuitRepeatBlock(item[1], self._build(item[2], params)))
+            elif getattr(params, item[3]) > 0:
+                # parsing the instruction is much faster than appending a long Python list of targets
+                circuit += stim.Circuit("%s(%r) %s" % (item[0], float(getattr(params, item[2])), item[1]))
+        return circuit
@@ -1,22 +1,275 @@
-import networkx as nx
-from itertools import chain, product
-
-
-def anti_commute(stab1: set, stab2: set) -> bool:
-    return len(stab1 & stab2) % 2 == 1
+import copy
+import gf2
+import math
+import numpy as np
+from collections import deque
+from heapq import heapify, heappop, heappush
+from itertools import accumulate, chain, product
+
+
+def csr_graph(num_nodes, edges):
+    # (indptr, indices, edge_ids) adjacency of an undirected graph given as a list of (u, v) node pairs.
+    # edge_ids[k] is the position in edges of the edge leading to indices[k].
+    degrees = [0] * (num_nodes + 1)
+    for u, v in edges:
+        degrees[u + 1] += 1
+        degrees[v + 1] += 1
+    indptr = list(accumulate(degrees))
+    indices = [0] * indptr[-1]
+    edge_ids = [0] * indptr[-1]
+    fill = indptr[:-1]
+    for i, (u, v) in enumerate(edges):
+        indices[fill[u]] = v
+        edge_ids[fill[u]] = i
+        fill[u] += 1
+        indices[fill[v]] = u
+        edge_ids[fill[v]] = i
+        fill[v] += 1
+    return indptr, indices, edge_ids
+
+
+def bfs_path_counts(indptr, indices, source, target):
+    # (w, n, n2): w is the number of edges of a shortest path from source to target, n and n2 are the numbers of
+    # paths from source to target with w and w + 1 edges. Parallel edges make distinct paths.
+    distance = [-1] * (len(indptr) - 1)
+    distance[source] = 0
+    order = [source]
+    for u in order:
+        for v in indices[indptr[u]:indptr[u + 1]]:
+            if distance[v] < 0:
+                distance[v] = distance[u] + 1
+                order.append(v)
+    if distance[target] < 0:
+        raise ValueError("No path between node %d and node %d" % (source, target))
+    # shortest[v] counts the walks from source to v with distance[v] edges, longer[v] those with distance[v] + 1.
+    # The latter cannot visit a node twice either, as the loop would cost at least two extra edges.
+    shortest = [0] * len(distance)
+    longer = [0] * len(distance)
+    shortest[source] = 1
+    for v in order[1:]:
+        for u in indices[indptr[v]:indptr[v + 1]]:
+            if distance[u] == distance[v] - 1:
+                shortest[v] += shortest[u]
+    for v in order:
+        for u in indices[indptr[v]:indptr[v + 1]]:
+            if distance[u] == distance[v]:
+                longer[v] += shortest[u]
+            elif distance[u] == distance[v] - 1:
+                longer[v] += longer[u]
+    return distance[target], shortest[target], longer[target]
+
+
+def dijkstra_distance(indptr, indices, weights, source, target):
+    # Weight of a lightest path from source to target, weights[k] being the weight of the edge leading to indices[k]
+    distance = [math.inf] * (len(indptr) - 1)
+    distance[source] = 0
+    heap = [(0, source)]
+    while heap:
+        d, u = heappop(heap)
+        if u == target:
+            return d
+        if d > distance[u]:
+            continue
+        for k in range(indptr[u], indptr[u + 1]):
+            v = indices[k]
+            if d + weights[k] < distance[v]:
+                distance[v] = d + weights[k]
+                heappush(heap, (distance[v], v))
+    raise ValueError("No path between node %d and node %d" % (source, target))
+
+
+def log_likelihood_weight(p):
+    # Weight log((1 - p) / p) of an edge flipped with probability p, 0 from p = 0.5 on
+    return math.log((1 - p) / p) if p < 0.5 else 0.0
+
+
+class DecodeGraph:
+    # CSR decoding graph of one basis: the nodes are the stabilizers, the super-stabilizers and the two edges, see
+    # LogicalQubit._decoding_graph_edges(), and each data qubit is an edge between the two nodes acting on it.
+    # The neighbors of node u are indices[indptr[u]:indptr[u + 1]], joined by the qubits qubits[k] of the same
+    # range; burst[k] is True if that qubit is in ano_coords. version is the change count of the patch it describes.
+    def __init__(self, nodes, edges, ano_coords, version=None):
+        self.nodes = nodes
+        self.labels = list(nodes.keys())
+        self.edges = edges
+        self.indptr, self.indices, edge_ids = csr_graph(len(nodes), [ends for q, ends in edges])
+        self.qubits = [edges[i][0] for i in edge_ids]
+        self.burst = [q in ano_coords for q in self.qubits]
+        self.version = version
+
+    def neighbors(self, u):
+        # (v, q) pairs of the nodes next to u and the qubits leading to them
+        start, end = self.indptr[u], self.indptr[u + 1]
+        return list(zip(self.indices[start:end], self.qubits[start:end]))
+
+
+class Component:
+    # Connected component of the graph of the delete pass of LogicalQubit._check: nodes holds measurement coordinates
+    # and super-stabilizer indices, support is the product of the measurements
+    def __init__(self, nodes, support):
+        self.nodes = nodes
+        self.support = support
+
+
+class QubitTable:
+    # Integer ids of the qubit coordinates of a rotated patch of distance size, assigned once. The grid
+    # 0 <= x, y <= 2 * size with x = y mod 2 is numbered pair of rows by pair of rows: id = x + (y - x % 2) *
+    # (size + 0.5), the stim index of the qubit. coords[id] is the coordinate of an id, None for the size ids past
+    # the last row, and index[coord] the id of a coordinate.
+    __slots__ = ("size", "coords", "index")
+
+    def __init__(self, size):
+        width = 2 * size + 1
+        self.size = size
+        self.coords = [(i % width, 2 * (i // width) + i % width % 2) for i in range((size + 1) * width)]
+        self.coords = [coord if coord[1] <= 2 * size else None for coord in self.coords]
+        self.index = {coord: i for i, coord in enumerate(self.coords) if coord is not None}
+
+    def __len__(self):
+        return len(self.coords)
+
+    def id(self, coord):
+        return self.index[coord]
+
+    def ids(self, coords):
+        return [self.index[coord] for coord in coords]
+
+    def sorted_ids(self, coords):
+        # ids of coords in increasing order, without sorting them
+        mask = np.zeros(len(self.coords), dtype=bool)
+        mask[self.ids(coords)] = True
+        return np.flatnonzero(mask).tolist()
+
+    def xy(self, ids):
+        # (x, y) arrays of the coordinates of an id array
+        width = 2 * self.size + 1
+        xs = ids % width
+        return xs, 2 * (ids // width) + xs % 2
+
+    def rows(self, rows):
+        # CSR (indptr, ids) of rows of coordinates, row i being ids[indptr[i]:indptr[i + 1]] in the order of the row
+        rows = list(rows)
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum([len(row) for row in rows], out=indptr[1:])
+        return indptr, np.array(self.ids(chain.from_iterable(rows)), dtype=np.int64)
+
+
+class QubitArrays:
+    # The patch in the ids of its QubitTable, see LogicalQubit.qubit_arrays(). measurements[kind][basis] holds the
+    # ids of the stabilizers ("stab") or gauges ("gauge") in dict order, supports[kind][basis] their supports and
+    # super_stabs[basis] the gauges of the super-stabilizers in dict order, as CSR (indptr, ids) rows in set order.
+    # observable[basis] and edges[basis][i] are in set order; data, ano and qubits (qubit_coords and ano_coords)
+    # are sorted. version is the change count of the patch it describes.
+    __slots__ = ("version", "measurements", "supports", "super_stabs", "observable", "edges", "data", "ano", "qubits")
+
+    def __init__(self, logical_qubit):
+        table = logical_qubit.qubit_table
+        self.version = logical_qubit._mutations
+        self.measurements, self.supports = {}, {}
+        for kind, measurements in (("stab", logical_qubit.stabs), ("gauge", logical_qubit.gauges)):
+            self.measurements[kind] = {basis: np.array(table.ids(measurements[basis]), dtype=np.int64)
+                                       for basis in "XZ"}
+            self.supports[kind] = {basis: table.rows(measurements[basis].values()) for basis in "XZ"}
+        self.super_stabs = {basis: table.rows(logical_qubit.super_stabs[basis].values()) for basis in "XZ"}
+        self.observable = {basis: np.array(table.ids(logical_qubit.observable[basis]), dtype=np.int64)
+                           for basis in "XZ"}
+        self.edges = {basis: [np.array(table.ids(edge), dtype=np.int64) for edge in logical_qubit.edges[basis]]
+                      for basis in "XZ"}
+        self.data = np.array(table.sorted_ids(logical_qubit.data_coords), dtype=np.int64)
+        self.ano = np.array(table.sorted_ids(logical_qubit.ano_coords), dtype=np.int64)
+        self.qubits = np.array(table.sorted_ids(logical_qubit.qubit_coords | logical_qubit.ano_coords), dtype=np.int64)
 
 
 class LogicalQubit:
-    def __init__(self, distance, is_rotated: bool):
+    GRID_CELL = 4
+
+    def __init__(self, distance, is_rotated: bool, check_mode="incremental", backend="set", split_mode="adaptive"):
         self.distance = {basis: distance for basis in "XZ"}
+        # distance of the undeformed patch
+        self.size = distance
+        self.is_rotated = is_rotated
         self.qubit_coords = set()
         self.data_coords = set()
         self.ano_coords = set()
         self.defect_coords = set()
+        # qubit_grid[(x // GRID_CELL, y // GRID_CELL)] holds every coordinate that has been in qubit_coords, so that
+        # the qubits near a point are found without scanning the patch
+        self.qubit_grid = {}
 
         self.stabs = {basis: {} for basis in "XZ"}
         self.gauges = {basis: {} for basis in "XZ"}
-        self.super_stabs = {basis: [] for basis in "XZ"}
+        # super_stabs[basis][idx] is the set of gauge coordinates whose product is a stabilizer
+        self.super_stabs = {basis: {} for basis in "XZ"}
+        # super_stab_supports[basis][idx] caches the product of the gauges of super_stabs[basis][idx]
+        self.super_stab_supports = {basis: {} for basis in "XZ"}
+        self._next_super_stab_idx = 0
+
+        # Reverse indices, kept in sync by the _set_measurement/_pop_measurement/... helpers:
+        # stab_index[basis][q] and gauge_index[basis][q] hold the coordinates of the measurements acting on
+        # data qubit q, super_stab_index[basis][coord] holds the indices of the super-stabilizers including
+        # gauge coord. Values are dicts used as ordered sets, so they follow the order of the indexed dicts.
+        self.stab_index = {basis: {} for basis in "XZ"}
+        self.gauge_index = {basis: {} for basis in "XZ"}
+        self.super_stab_index = {basis: {} for basis in "XZ"}
+
+        # "incremental": _check only revisits what the mutations since its last pass dirtied
+        # "sweep": _check revisits the whole patch on every round
+        # "verify": incremental, then assert that a sweep would find nothing left to do and that the cached
+        # super-stabilizer supports match their recomputation
+        self.check_mode = check_mode
+        # "always": the split pass of _check runs the sweeps of every super-stabilizer, as the original pass did
+        # "adaptive": a super-stabilizer whose gauges, anti-commutations and gauge ranks are unchanged since a visit
+        # that found it connected cannot split. Its visit replays the set operations that visit did for the same
+        # popped gauge instead of running the sweeps again, so the patch is the same as with "always".
+        # "verify": runs the sweeps of every super-stabilizer and asserts that the replays would agree
+        self.split_mode = split_mode
+
+        # "set": commutation is tested on the support sets
+        # "bits": stabilizers and gauges are also kept as GF(2) bit rows over data_index, commutation is a
+        # popcount parity and the gauge anti-commutation table of _check is a single matrix product
+        self.backend = backend
+        self.data_index = {}
+        self.rows = {kind: {basis: {} for basis in "XZ"} for kind in ("stab", "gauge")}
+        # Worklists of _check, filled by the mutation helpers. _order holds the insertion rank of each
+        # stabilizer/gauge so that worklists are visited in the order a sweep over the dicts would visit them.
+        self._dirty_data = set()
+        self._dirty = {phase: {basis: set() for basis in "XZ"} for phase in ("gauge", "gauge_size", "stab", "super_stab")}
+        self._order = {kind: {basis: {} for basis in "XZ"} for kind in ("stab", "gauge")}
+        self._insertions = 0
+        # components[basis][node] is the Component of node in the $basis$ graph of the delete pass of _check, as of its
+        # last pass. _dirty_components[basis] holds the nodes whose edges or support changed since, _dirty_coords the
+        # coordinates that may have joined or left data_coords/qubit_coords.
+        self.components = {basis: {} for basis in "XZ"}
+        self._dirty_components = {basis: set() for basis in "XZ"}
+        self._dirty_coords = set()
+        # anti_comm_rows[basis][coord] caches the coordinates of the gauges of the other basis anti-commuting with the
+        # $basis$ gauge at coord for the split pass, _dirty_rows[basis] holds the gauges whose entry may be stale and
+        # _dirty_super_stabs[basis] the super-stabilizers whose gauges changed since the last split pass.
+        # split_orders[basis][idx][coord] is the order in which the last visits of the unchanged super-stabilizer idx
+        # moved its gauges out after popping coord, when they found it connected without running irregular sweeps.
+        self.anti_comm_rows = {basis: {} for basis in "XZ"}
+        self._dirty_rows = {basis: set() for basis in "XZ"}
+        self._dirty_super_stabs = {basis: set() for basis in "XZ"}
+        self.split_orders = {basis: {} for basis in "XZ"}
+        self._sweeps = {}
+
+        # _operations lists the (name, args) of the calls that changed the patch since it was built, from scratch or by
+        # from_state(_origin). The deformation picks qubits with set.pop() and walks its sets in their internal order,
+        # which neither a copy of a set nor undoing its changes restores, so fork() and rollback() build the patch
+        # again by replaying them. The journal, started by the first savepoint(), holds the operations from position
+        # _journal on.
+        self._origin = None
+        self._operations = []
+        self._journal = None
+        # Count of the changes of the patch, update_distance() is skipped while it stays at _distance_version
+        self._mutations = 0
+        self._distance_version = None
+        # logical_counts[basis] is the number of $basis$ logical operators of weight distance[basis] and of weight
+        # distance[basis] + 1, filled in by update_distance()
+        self.logical_counts = {basis: None for basis in "XZ"}
+        # effective_distance() results by (p, p_burst), valid while _mutations stays at _effective_version
+        self._effective_distances = {}
+        self._effective_version = None
 
         self.observable = {basis: set() for basis in "XZ"}
         # Each qubit on edge[basis] has only one $basis$ stabilizer acting on it
@@ -25,11 +278,15 @@ class LogicalQubit:
         self.corners = [[None, None],
                         [None, None]]
 
+        # decode_graph[basis] is the DecodeGraph of the last decoding_graph(basis) call, _qubit_arrays the
+        # QubitArrays of the last qubit_arrays() call
         self.decode_graph = {basis: None for basis in "XZ"}
+        self._qubit_arrays = None
 
         if is_rotated:
             self.generate_rotated_surface_code()
-            self.coord_to_index = lambda q: int(q[0] + (q[1] - q[0] % 2) * (distance + 0.5))
+            self.qubit_table = QubitTable(distance)
+            self.coord_to_index = self.qubit_table.id
         else:
             pass
 
@@ -41,6 +298,7 @@ class LogicalQubit:
             for y in range(d):
                 q = (x * 2 + 1, y * 2 + 1)
                 self.data_coords.add(q)
+                self.data_index[q] = len(self.data_index)
 
                 if x == 0:
                     self.observable["X"].add(q)
@@ -80,16 +338,48 @@ class LogicalQubit:
                 elif on_boundary_2 and not parity:
                     pass
                 elif parity:
-                    self.stabs["X"][q] = neighbors(q)
+                    self._set_measurement("stab", "X", q, neighbors(q))
                 else:
-                    self.stabs["Z"][q] = neighbors(q)
+                    self._set_measurement("stab", "Z", q, neighbors(q))
 
         self._check()
 
     def burst_error(self, coord, r):
-        for q in self.qubit_coords:
-            if pow(q[0] - coord[0], 2) + pow(q[1] - coord[1], 2) <= 2 * pow(r, 2):
-                self.ano_coords.add(q)
+        self._record("burst_error", coord, r)
+        self.ano_coords.update(self.burst_qubits(coord, r))
+
+    def burst_qubits(self, coord, r):
+        # qubits hit by burst_error(coord, r)
+        return [q for q in self.qubits_near(coord, r)
+                if pow(q[0] - coord[0], 2) + pow(q[1] - coord[1], 2) <= 2 * pow(r, 2)]
+
+    def burst_errors(self, centers, radii):
+        # burst_error for each center (a (n, 2) array) and radius (a scalar or an (n,) array) at once. Returns the
+        # list of the qubits hit by each burst.
+        centers = np.array(centers).reshape(-1, 2)
+        radii = np.array(np.broadcast_to(radii, len(centers)))
+        self._record("burst_errors", centers, radii)
+        bursts, coords = [], []
+        for k, (center, r) in enumerate(zip(centers.tolist(), radii.tolist())):
+            for q in self.qubits_near(center, r):
+                bursts.append(k)
+                coords.append(q)
+        hits = [[] for _ in range(len(centers))]
+        if coords:
+            offsets = np.array(coords) - centers[bursts]
+            inside = (offsets ** 2).sum(axis=1) <= 2 * radii[bursts] ** 2
+            for k, q in zip(np.array(bursts)[inside].tolist(), np.array(coords)[inside].tolist()):
+                hits[k].append(tuple(q))
+        for qubits in hits:
+            self.ano_coords.update(qubits)
+        return hits
+
+    def qubits_near(self, coord, r):
+        # qubits of qubit_coords in the cells touched by the square around coord containing the burst disk
+        reach = r * 1.5
+        cells = [range(int((coord[i] - reach) // self.GRID_CELL), int((coord[i] + reach) // self.GRID_CELL) + 1)
+                 for i in range(2)]
+        return [q for cell in product(*cells) for q in self.qubit_grid.get(cell, ()) if q in self.qubit_coords]
 
     def super_stabilizer(self, basis, gauge_coords):
         super_stab = set()
@@ -97,38 +387,538 @@ class LogicalQubit:
             super_stab.symmetric_difference_update(self.gauges[basis][coord])
         return super_stab
 
+    def super_stab_support(self, basis, idx):
+        support = self.super_stab_supports[basis][idx]
+        if self.check_mode == "verify":
+            assert support == self.super_stabilizer(basis, self.super_stabs[basis][idx]), idx
+        return support
+
+    def stabs_on(self, basis, q):
+        # coordinates of the $basis$ stabilizers acting on data qubit q, in the order of self.stabs[basis]
+        return list(self.stab_index[basis].get(q, ()))
+
+    def gauges_on(self, basis, q):
+        # coordinates of the $basis$ gauges acting on data qubit q, in the order of self.gauges[basis]
+        return list(self.gauge_index[basis].get(q, ()))
+
+    def super_stabs_on(self, basis, q):
+        # indices of the $basis$ super-stabilizers acting on data qubit q, in the order of self.super_stabs[basis]
+        parity = {}
+        for coord in self.gauge_index[basis].get(q, ()):
+            for idx in self.super_stab_index[basis].get(coord, ()):
+                parity[idx] = not parity.get(idx, False)
+        return sorted(idx for idx, odd in parity.items() if odd)
+
     def disable(self, coord):
+        # With the journal started, a disable() that raises is rolled back before the exception propagates
+        savepoint = len(self._operations)
+        self._record("disable", coord)
+        if self._journal is None:
+            self._disable(coord)
+            return
+        try:
+            self._disable(coord)
+        except BaseException:
+            self.rollback(savepoint)
+            raise
+
+    def _disable(self, coord):
         self.defect_coords.add(coord)
         if coord in self.data_coords:
             self._disable_data(coord)
         elif coord in self.qubit_coords:
             self._disable_ancilla(coord)
 
+    def fork(self):
+        # Independent copy of the patch, built again from the same start by replaying the operations that made it, so
+        # that its sets are in the same internal order and both patches deform alike from there. It costs as much as
+        # building the patch. The fork starts without a journal.
+        return self._replay(self._operations)
+
+    def _replay(self, operations):
+        # New patch built from the start of this one, followed by operations
+        if self._origin is None:
+            other = type(self)(self.size, self.is_rotated, self.check_mode, self.backend, self.split_mode)
+        else:
+            other = type(self).from_state(self._origin, self.check_mode, self.backend, self.split_mode)
+        for name, args in operations:
+            getattr(other, name)(*args)
+        return other
+
+    def _rebuild(self, operations):
+        # Replace the patch by _replay(operations), keeping the journal
+        journal = self._journal
+        self.__dict__.update(self._replay(operations).__dict__)
+        self._journal = journal
+
+    def state(self):
+        # Plain-data description of the patch: the measurements in dict order, the super-stabilizers, the logical
+        # operators and the coordinate sets. from_state() builds the patch back.
+        return {
+            "size": self.size,
+            "is_rotated": self.is_rotated,
+            "distance": dict(self.distance),
+            "stabs": {basis: [(coord, sorted(stab)) for coord, stab in self.stabs[basis].items()] for basis in "XZ"},
+            "gauges": {basis: [(coord, sorted(gauge)) for coord, gauge in self.gauges[basis].items()] for basis in "XZ"},
+            "super_stabs": {basis: [(idx, sorted(gauge_coords)) for idx, gauge_coords in self.super_stabs[basis].items()]
+                            for basis in "XZ"},
+            "observable": {basis: sorted(self.observable[basis]) for basis in "XZ"},
+            "edges": {basis: [sorted(edge) for edge in self.edges[basis]] for basis in "XZ"},
+            "corners": [list(row) for row in self.corners],
+            "data_coords": sorted(self.data_coords),
+            "qubit_coords": sorted(self.qubit_coords),
+            "ano_coords": sorted(self.ano_coords),
+            "defect_coords": sorted(self.defect_coords),
+        }
+
+    @classmethod
+    def from_state(cls, state, check_mode="incremental", backend="set", split_mode="adaptive"):
+        self = cls(state["size"], state["is_rotated"], check_mode, backend, split_mode)
+        self.distance = dict(state["distance"])
+        for kind, measurements in (("stab", self.stabs), ("gauge", self.gauges)):
+            for basis in "XZ":
+                measurements[basis] = {coord: set(support) for coord, support in state[kind + "s"][basis]}
+                self._order[kind][basis] = {}
+                for coord in measurements[basis]:
+                    self._order[kind][basis][coord] = self._insertions
+                    self._insertions += 1
+        for basis in "XZ":
+            self.super_stabs[basis] = {idx: set(gauge_coords) for idx, gauge_coords in state["super_stabs"][basis]}
+            self._next_super_stab_idx = max([self._next_super_stab_idx, *(idx + 1 for idx in self.super_stabs[basis])])
+            self.observable[basis] = set(state["observable"][basis])
+            self.edges[basis] = [set(edge) for edge in state["edges"][basis]]
+        self.corners = [list(row) for row in state["corners"]]
+        self.data_coords = set(state["data_coords"])
+        self.qubit_coords = set(state["qubit_coords"])
+        self._index_qubits(self.qubit_coords)
+        self.ano_coords = set(state["ano_coords"])
+        self.defect_coords = set(state["defect_coords"])
+        self._dirty_data = set()
+        self._dirty = {phase: {basis: set() for basis in "XZ"} for phase in self._dirty}
+        self._dirty_coords = set()
+        self._reindex()
+        self._origin = copy.deepcopy(state)
+        return self
+
+    def savepoint(self):
+        # Start the journal if needed and return a position to roll back to
+        if self._journal is None:
+            self._journal = len(self._operations)
+        return len(self._operations)
+
+    def rollback(self, savepoint):
+        # Undo the operations journaled since savepoint by building the patch again with those before it. It costs
+        # as much as fork().
+        if self._journal is None or not self._journal <= savepoint <= len(self._operations):
+            raise ValueError("Savepoint %s is not in the journal" % (savepoint,))
+        if savepoint < len(self._operations):
+            self._rebuild(self._operations[:savepoint])
+
+    def commit(self):
+        # Forget the journal, the current patch can no longer be rolled back
+        if self._journal is not None:
+            self._journal = len(self._operations)
+
+    def _journaled_disables(self):
+        # positions of the disable() calls in the journal
+        start = len(self._operations) if self._journal is None else self._journal
+        return [i for i in range(start, len(self._operations)) if self._operations[i][0] == "disable"]
+
+    def undo(self):
+        # Roll back the last journaled disable() and return its coordinate
+        i = self._journaled_disables()[-1]
+        coord = self._operations[i][1][0]
+        self.rollback(i)
+        return coord
+
+    def enable(self, coord):
+        # Build the patch again without the first journaled disable() of coord, replaying the operations after it
+        for i in self._journaled_disables():
+            if self._operations[i][1][0] == coord:
+                break
+        else:
+            raise ValueError("%s was not disabled since the journal started" % (coord,))
+        self._rebuild(self._operations[:i] + self._operations[i + 1:])
+
     def update_distance(self):
+        # distance[basis2] is the length of a shortest path between the two $basis$ edges in the decoding graph of
+        # $basis$, see decoding_graph(), and logical_counts[basis2] the numbers of such paths of that length and of
+        # one more edge. The result is kept until the next change of the patch.
+        if self._distance_version == self._mutations:
+            return
+        self._record("update_distance")
         if self.observable:
             for basis, basis2 in ["XZ", "ZX"]:
-                G = nx.Graph()
-                G.add_nodes_from(self.stabs[basis].keys())
-                G.add_nodes_from(["s%d" % k for k in range(len(self.super_stabs[basis]))])
-                G.add_nodes_from(["e0", "e1"])
-                G_edges = {q: [] for q in self.data_coords}
-
-                for coord, stab in self.stabs[basis].items():
-                    for q in stab:
-                        G_edges[q].append(coord)
-                for idx, super_stab in enumerate(self.super_stabs[basis]):
-                    for q in self.super_stabilizer(basis, super_stab):
-                        G_edges[q].append("s%d" % idx)
-                for k in range(2):
-                    for q in self.edges[basis][k]:
-                        G_edges[q].append("e%d" % k)
-
-                for q in self.data_coords:
-                    if G_edges[q]:
-                        G.add_edge(*G_edges[q])
-                self.distance[basis2] = nx.shortest_path_length(G, "e0", "e1")
+                graph = self.decoding_graph(basis)
+                w, n, n2 = bfs_path_counts(graph.indptr, graph.indices, graph.nodes["e0"], graph.nodes["e1"])
+                self.distance[basis2] = w
+                self.logical_counts[basis2] = (n, n2)
         else:
             self.distance = {"X": 1, "Z": 1}
+            self.logical_counts = {basis: None for basis in "XZ"}
+        if self.check_mode == "verify":
+            assert self.distance == self._networkx_distance(), self.distance
+        self._distance_version = self._mutations
+
+    def effective_distance(self, p, p_burst):
+        # {basis: d} where d is the weight of a lightest $basis$ logical operator when the data qubits flip with
+        # probability p, and those of ano_coords with probability p_burst, in units of the weight of a qubit flipped
+        # with probability p. Without bursts it is distance[basis].
+        if not 0 < p < 0.5 or not 0 < p_burst <= 1:
+            raise ValueError("Invalid error rates p=%s, p_burst=%s" % (p, p_burst))
+        if self._effective_version != self._mutations:
+            self._effective_distances = {}
+            self._effective_version = self._mutations
+        if (p, p_burst) not in self._effective_distances:
+            weight = log_likelihood_weight(p)
+            burst_weight = log_likelihood_weight(p_burst) / weight
+            distance = {}
+            for basis, basis2 in ["XZ", "ZX"]:
+                graph = self.decoding_graph(basis)
+                weights = [burst_weight if burst else 1.0 for burst in graph.burst]
+                distance[basis2] = dijkstra_distance(graph.indptr, graph.indices, weights, graph.nodes["e0"],
+                                                     graph.nodes["e1"])
+            self._effective_distances[p, p_burst] = {basis: distance[basis] for basis in "XZ"}
+        return dict(self._effective_distances[p, p_burst])
+
+    def decoding_graph(self, basis):
+        # decode_graph[basis], built again only if the patch changed since the last call
+        graph = self.decode_graph[basis]
+        if graph is None or graph.version != self._mutations:
+            nodes, edges = self._decoding_graph_edges(basis)
+            graph = self.decode_graph[basis] = DecodeGraph(nodes, edges, self.ano_coords, self._mutations)
+        return graph
+
+    def qubit_arrays(self):
+        # QubitArrays of the patch, built again only if the patch changed since the last call
+        if self._qubit_arrays is None or self._qubit_arrays.version != self._mutations:
+            self._qubit_arrays = QubitArrays(self)
+        return self._qubit_arrays
+
+    def _decoding_graph_edges(self, basis):
+        # (nodes, edges) of the decoding graph of $basis$. nodes maps the $basis$ stabilizer coordinates, "s%d" % idx
+        # for the super-stabilizers and "e0"/"e1" for the edges to consecutive integers. edges lists (q, (u, v)): data
+        # qubit q joins the two nodes acting on it.
+        nodes = {}
+        ends = {}
+        for coord, stab in self.stabs[basis].items():
+            nodes[coord] = len(nodes)
+            for q in stab:
+                ends.setdefault(q, []).append(nodes[coord])
+        for idx in self.super_stabs[basis].keys():
+            nodes["s%d" % idx] = len(nodes)
+            for q in self.super_stab_support(basis, idx):
+                ends.setdefault(q, []).append(nodes["s%d" % idx])
+        for k in range(2):
+            nodes["e%d" % k] = len(nodes)
+            for q in self.edges[basis][k]:
+                ends.setdefault(q, []).append(nodes["e%d" % k])
+        for q, ends_q in ends.items():
+            assert len(ends_q) == 2, q
+        return nodes, [(q, tuple(ends_q)) for q, ends_q in ends.items()]
+
+    def _networkx_distance(self):
+        # Reference implementation of update_distance on networkx graphs, imported here so that workers deforming
+        # patches never load networkx
+        import networkx as nx
+        distance = {}
+        for basis, basis2 in ["XZ", "ZX"]:
+            G = nx.Graph()
+            G.add_nodes_from(self.stabs[basis].keys())
+            G.add_nodes_from(["s%d" % idx for idx in self.super_stabs[basis].keys()])
+            G.add_nodes_from(["e0", "e1"])
+            G_edges = {q: [] for q in self.data_coords}
+
+            for coord, stab in self.stabs[basis].items():
+                for q in stab:
+                    G_edges[q].append(coord)
+            for idx in self.super_stabs[basis].keys():
+                for q in self.super_stab_support(basis, idx):
+                    G_edges[q].append("s%d" % idx)
+            for k in range(2):
+                for q in self.edges[basis][k]:
+                    G_edges[q].append("e%d" % k)
+
+            for q in self.data_coords:
+                if G_edges[q]:
+                    G.add_edge(*G_edges[q])
+            distance[basis2] = nx.shortest_path_length(G, "e0", "e1")
+        return distance
+
+    def _measurement_tables(self, kind):
+        return (self.stabs, self.stab_index) if kind == "stab" else (self.gauges, self.gauge_index)
+
+    def _set_measurement(self, kind, basis, coord, support):
+        measurements, index = self._measurement_tables(kind)
+        old_support = measurements[basis].get(coord)
+        if old_support is None:
+            self._order[kind][basis][coord] = self._insertions
+            self._insertions += 1
+            old_support = set()
+            if kind == "gauge":
+                # the sweeps of the split pass follow the ranks of the gauges
+                self._dirty_super_stabs[basis].update(self.super_stab_index[basis].get(coord, ()))
+        elif kind == "gauge":
+            self._dirty_gauge_neighbors(basis, old_support)
+        if kind == "gauge":
+            self._update_super_stab_supports(basis, coord, old_support.symmetric_difference(support))
+        measurements[basis][coord] = support
+        for q in old_support.difference(support):
+            self._unindex(index[basis], q, coord)
+        for q in support.difference(old_support):
+            index[basis].setdefault(q, {})[coord] = None
+        if self.backend == "bits":
+            self.rows[kind][basis][coord] = gf2.support_row(support, self.data_index)
+        changed = old_support.symmetric_difference(support)
+        if coord in self.components[basis]:
+            self.components[basis][coord].support.symmetric_difference_update(changed)
+        self._dirty_components[basis].add(coord)
+        self._dirty_coords.add(coord)
+        self._dirty_components_on(basis, changed)
+        if kind == "gauge":
+            self._dirty_rows_on(basis, coord, changed)
+
+        if kind == "stab":
+            self._mark("stab", basis, coord)
+        else:
+            self._dirty_data.add(coord)
+            self._mark("gauge", basis, coord)
+            self._mark("gauge_size", basis, coord)
+
+    def _pop_measurement(self, kind, basis, coord):
+        measurements, index = self._measurement_tables(kind)
+        support = measurements[basis].pop(coord)
+        del self._order[kind][basis][coord]
+        for q in support:
+            self._unindex(index[basis], q, coord)
+        if self.backend == "bits":
+            del self.rows[kind][basis][coord]
+        if kind == "gauge":
+            self._dirty_gauge_neighbors(basis, support)
+            self._update_super_stab_supports(basis, coord, support)
+        component = self.components[basis].pop(coord, None)
+        if component is not None:
+            component.nodes.remove(coord)
+            component.support.symmetric_difference_update(support)
+        self._dirty_coords.add(coord)
+        self._dirty_components_on(basis, support)
+        if kind == "gauge":
+            self.anti_comm_rows[basis].pop(coord, None)
+            self._dirty_rows_on(basis, coord, support)
+        return support
+
+    def _discard_qubit(self, kind, basis, coord, q):
+        measurements, index = self._measurement_tables(kind)
+        if q in measurements[basis][coord]:
+            measurements[basis][coord].discard(q)
+            self._unindex(index[basis], q, coord)
+            self._dirty_support(kind, basis, coord, q)
+
+    def _pop_qubit(self, kind, basis, coord):
+        measurements, index = self._measurement_tables(kind)
+        q = measurements[basis][coord].pop()
+        self._unindex(index[basis], q, coord)
+        self._dirty_support(kind, basis, coord, q)
+        return q
+
+    def _add_super_stab(self, basis, gauge_coords):
+        idx = self._next_super_stab_idx
+        self._next_super_stab_idx += 1
+        self.super_stabs[basis][idx] = gauge_coords
+        self.super_stab_supports[basis][idx] = set()
+        for coord in gauge_coords:
+            self.super_stab_index[basis].setdefault(coord, {})[idx] = None
+            self.super_stab_supports[basis][idx].symmetric_difference_update(self.gauges[basis].get(coord, ()))
+        if not gauge_coords:
+            self._dirty["super_stab"][basis].add(idx)
+        self._dirty_components[basis].add(idx)
+        self._dirty_components[basis].update(gauge_coords)
+        self._dirty_super_stabs[basis].add(idx)
+        return idx
+
+    def _pop_super_stab(self, basis, idx):
+        gauge_coords = self.super_stabs[basis].pop(idx)
+        del self.super_stab_supports[basis][idx]
+        for coord in gauge_coords:
+            self._unindex(self.super_stab_index[basis], coord, idx)
+            self._mark("gauge", basis, coord)
+        component = self.components[basis].pop(idx, None)
+        if component is not None:
+            component.nodes.remove(idx)
+        self._dirty_components[basis].update(gauge_coords)
+        return gauge_coords
+
+    def _add_to_super_stab(self, basis, idx, coord):
+        if coord not in self.super_stabs[basis][idx]:
+            self.super_stabs[basis][idx].add(coord)
+            self.super_stab_index[basis].setdefault(coord, {})[idx] = None
+            self.super_stab_supports[basis][idx].symmetric_difference_update(self.gauges[basis].get(coord, ()))
+            self._dirty_components[basis].add(idx)
+            self._dirty_super_stabs[basis].add(idx)
+
+    def _discard_from_super_stab(self, basis, idx, coord):
+        if coord in self.super_stabs[basis][idx]:
+            self.super_stabs[basis][idx].discard(coord)
+            self._unindex(self.super_stab_index[basis], coord, idx)
+            self.super_stab_supports[basis][idx].symmetric_difference_update(self.gauges[basis].get(coord, ()))
+            self._mark("gauge", basis, coord)
+            self._dirty_components[basis].update((idx, coord))
+            self._dirty_super_stabs[basis].add(idx)
+            if not self.super_stabs[basis][idx]:
+                self._dirty["super_stab"][basis].add(idx)
+
+    def _toggle_super_stab(self, basis, idx, gauge_coords):
+        # super_stabs[basis][idx] ^= gauge_coords
+        super_stab = self.super_stabs[basis][idx]
+        for coord in gauge_coords:
+            self.super_stab_supports[basis][idx].symmetric_difference_update(self.gauges[basis].get(coord, ()))
+            if coord in super_stab:
+                self._unindex(self.super_stab_index[basis], coord, idx)
+                self._mark("gauge", basis, coord)
+            else:
+                self.super_stab_index[basis].setdefault(coord, {})[idx] = None
+        super_stab.symmetric_difference_update(gauge_coords)
+        self._dirty_components[basis].add(idx)
+        self._dirty_components[basis].update(gauge_coords)
+        self._dirty_super_stabs[basis].add(idx)
+        if not super_stab:
+            self._dirty["super_stab"][basis].add(idx)
+
+    def _update_super_stab_supports(self, basis, coord, support):
+        # the support of the $basis$ gauge at coord changed by support
+        for idx in self.super_stab_index[basis].get(coord, ()):
+            self.super_stab_supports[basis][idx].symmetric_difference_update(support)
+
+    def _dirty_support(self, kind, basis, coord, q):
+        # the support of a measurement lost q
+        if self.backend == "bits":
+            self.rows[kind][basis][coord] ^= 1 << self.data_index[q]
+        if coord in self.components[basis]:
+            self.components[basis][coord].support.symmetric_difference_update({q})
+        self._dirty_components[basis].add(coord)
+        self._dirty_components_on(basis, [q])
+        if kind == "gauge":
+            self._dirty_rows_on(basis, coord, [q])
+        if kind == "stab":
+            self._mark("stab", basis, coord)
+        else:
+            self._update_super_stab_supports(basis, coord, {q})
+            self._mark("gauge", basis, coord)
+            self._mark("gauge_size", basis, coord)
+            self._dirty_gauge_neighbors(basis, {q})
+
+    def _dirty_gauge_neighbors(self, basis, support):
+        # gauges of the other basis whose commutation with a $basis$ gauge on support may have changed
+        basis2 = "XZ"[basis == "X"]
+        for q in support:
+            for coord in self.gauge_index[basis2].get(q, ()):
+                self._mark("gauge", basis2, coord)
+
+    def _dirty_components_on(self, basis, support):
+        # the number of $basis$ measurements on the qubits of support changed, which decides whether a qubit links
+        # the measurements acting on it
+        for q in support:
+            self._dirty_components[basis].update(self.stab_index[basis].get(q, ()))
+            self._dirty_components[basis].update(self.gauge_index[basis].get(q, ()))
+        self._dirty_coords.update(support)
+
+    def _dirty_rows_on(self, basis, coord, support):
+        # the support of the $basis$ gauge at coord changed on support, which may change its anti-commutations with
+        # the gauges of the other basis acting there
+        basis2 = "XZ"[basis == "X"]
+        self._dirty_rows[basis].add(coord)
+        for q in support:
+            self._dirty_rows[basis2].update(self.gauge_index[basis2].get(q, ()))
+
+    def _mark(self, phase, basis, coord):
+        kind = "stab" if phase == "stab" else "gauge"
+        rank = self._order[kind][basis].get(coord)
+        if rank is None:
+            return
+        sweep = self._sweeps.get((phase, basis))
+        if sweep is not None and sweep[0] < rank < sweep[1]:
+            # the running pass has not reached coord yet
+            heappush(sweep[2], (rank, coord))
+        else:
+            self._dirty[phase][basis].add(coord)
+
+    def _worklist(self, phase, basis):
+        # Yield the coordinates the $phase$ pass of _check has to visit, in the order a sweep over
+        # list(measurements.items()) would. Coordinates dirtied during the pass are still visited in this pass
+        # if the sweep would meet them later, otherwise they are left for the next round.
+        kind = "stab" if phase == "stab" else "gauge"
+        measurements = self._measurement_tables(kind)[0][basis]
+        if self.check_mode == "sweep":
+            self._dirty[phase][basis].clear()
+            for coord in list(measurements.keys()):
+                if coord in measurements:
+                    yield coord
+            return
+
+        order = self._order[kind][basis]
+        heap = [(order[coord], coord) for coord in self._dirty[phase][basis] if coord in order]
+        heapify(heap)
+        self._dirty[phase][basis] = set()
+        sweep = self._sweeps[phase, basis] = [-1, self._insertions, heap]
+        try:
+            while heap:
+                rank, coord = heappop(heap)
+                if rank > sweep[0] and order.get(coord) == rank:
+                    sweep[0] = rank
+                    yield coord
+        finally:
+            self._sweeps.pop((phase, basis), None)
+
+    def _record(self, name, *args):
+        # record a call changing the patch, to replay in fork() and rollback()
+        self._operations.append((name, args))
+        self._mutations += 1
+
+    def _index_qubits(self, coords):
+        for q in coords:
+            self.qubit_grid.setdefault((q[0] // self.GRID_CELL, q[1] // self.GRID_CELL), set()).add(q)
+
+    def _set_corner(self, i, j, q):
+        self.corners[i][j] = q
+
+    def _reindex(self):
+        # Rebuild everything derived from stabs, gauges and super_stabs, and order them by _order
+        self._mutations += 1
+        for kind, basis in product(("stab", "gauge"), "XZ"):
+            measurements, index = self._measurement_tables(kind)
+            order = self._order[kind][basis]
+            for mapping in (order, measurements[basis]):
+                items = sorted(mapping.items(), key=lambda item: order[item[0]])
+                mapping.clear()
+                mapping.update(items)
+            index[basis] = {}
+            for coord, support in measurements[basis].items():
+                for q in support:
+                    index[basis].setdefault(q, {})[coord] = None
+            if self.backend == "bits":
+                self.rows[kind][basis] = {coord: gf2.support_row(support, self.data_index)
+                                          for coord, support in measurements[basis].items()}
+        for basis in "XZ":
+            items = sorted(self.super_stabs[basis].items())
+            self.super_stabs[basis].clear()
+            self.super_stabs[basis].update(items)
+            self.super_stab_index[basis] = {}
+            for idx, gauge_coords in items:
+                for coord in gauge_coords:
+                    self.super_stab_index[basis].setdefault(coord, {})[idx] = None
+            self.super_stab_supports[basis] = {idx: self.super_stabilizer(basis, gauge_coords) for idx, gauge_coords in items}
+            self.components[basis] = {}
+            self._dirty_components[basis] = set(chain(self.stabs[basis], self.gauges[basis], self.super_stabs[basis]))
+            self.anti_comm_rows[basis] = {}
+            self._dirty_rows[basis] = set(self.gauges[basis])
+            self._dirty_super_stabs[basis] = set(self.super_stabs[basis])
+            self.split_orders[basis] = {}
+
+    @staticmethod
+    def _unindex(index, key, value):
+        del index[key][value]
+        if not index[key]:
+            del index[key]
 
     def _disable_data(self, coord):
         # print(coord)
@@ -144,13 +934,12 @@ class LogicalQubit:
             else:
                 anti_stab = {basis: set() for basis in "XZ"}
                 for basis in "XZ":
-                    for stab in self.stabs[basis].values():
-                        if coord in stab:
-                            anti_stab[basis] = stab
-                    for gauge_coords in self.super_stabs[basis]:
-                        stab = self.super_stabilizer(basis, gauge_coords)
-                        if coord in stab:
-                            anti_stab[basis] = stab
+                    anti_super_stabs = self.super_stabs_on(basis, coord)
+                    anti_stabs = self.stabs_on(basis, coord)
+                    if anti_super_stabs:
+                        anti_stab[basis] = set(self.super_stab_support(basis, anti_super_stabs[-1]))
+                    elif anti_stabs:
+                        anti_stab[basis] = self.stabs[basis][anti_stabs[-1]]
 
                 if rel_edge_idx["X"] == -1 or rel_edge_idx["Z"] == -1:
                     # coord is on edge[basis]
@@ -225,10 +1014,10 @@ class LogicalQubit:
                             self._disable_data(self.corners[i][j])
                             continue
                         else:
-                            self.corners[i][j] = new_corner(self.corners[i][j])
+                            self._set_corner(i, j, new_corner(self.corners[i][j]))
 
                     edge = self.edges[basis][rel_edge_idx[basis]]
-                    self.corners[rel_edge_idx["X"]][rel_edge_idx["Z"]] = new_corner(coord)
+                    self._set_corner(rel_edge_idx["X"], rel_edge_idx["Z"], new_corner(coord))
 
                     self._add_gauge(basis, coord)
                     self._fix_gauge(basis, coord)
@@ -236,10 +1025,10 @@ class LogicalQubit:
             self._check()
 
     def _disable_ancilla(self, coord):
-        basis, basis2 = "XZ" if coord in chain(self.stabs["X"].keys(), self.gauges["X"].keys()) else "ZX"
+        basis, basis2 = "XZ" if coord in self.stabs["X"] or coord in self.gauges["X"] else "ZX"
         # If $basis$ stabilizer/gauge contains qubit in $basis2$ edge, the count is exactly 2
-        while coord in chain(self.stabs[basis].keys(), self.gauges[basis].keys()):
-            measurement = self.stabs[basis][coord] if coord in self.stabs[basis].keys() else self.gauges[basis][coord]
+        while coord in self.stabs[basis] or coord in self.gauges[basis]:
+            measurement = self.stabs[basis][coord] if coord in self.stabs[basis] else self.gauges[basis][coord]
             super_stab = set()
             edge_qubits = set()
             corner_qubit = set()
@@ -254,8 +1043,8 @@ class LogicalQubit:
                 #     raise Exception("Too small distance")
                 sum_coord = tuple(map(sum, zip(*edge_qubits)))
                 coord2 = (sum_coord[0] - coord[0], sum_coord[1] - coord[1])
-                if len(edge_qubits) == 2 and coord2 not in self.qubit_coords.union(self.defect_coords):
-                    self.gauges[basis][coord2] = edge_qubits
+                if len(edge_qubits) == 2 and coord2 not in self.qubit_coords and coord2 not in self.defect_coords:
+                    self._set_measurement("gauge", basis, coord2, edge_qubits)
                     super_stab.add(coord2)
                 else:
                     self._disable_data(corner_qubit.pop() if corner_qubit else edge_qubits.pop())
@@ -265,15 +1054,14 @@ class LogicalQubit:
                 self._add_gauge(basis, q)
                 super_stab.add(q)
 
-            if coord in self.stabs[basis].keys():
-                self.stabs[basis].pop(coord)
-                self.super_stabs[basis].append(super_stab)
-            elif coord in self.gauges[basis].keys():
-                self.gauges[basis].pop(coord)
-                for super_stab2 in self.super_stabs[basis]:
-                    if coord in super_stab2:
-                        super_stab2.remove(coord)
-                        super_stab2.symmetric_difference_update(super_stab)
+            if coord in self.stabs[basis]:
+                self._pop_measurement("stab", basis, coord)
+                self._add_super_stab(basis, super_stab)
+            elif coord in self.gauges[basis]:
+                self._pop_measurement("gauge", basis, coord)
+                for idx in list(self.super_stab_index[basis].get(coord, ())):
+                    self._discard_from_super_stab(basis, idx, coord)
+                    self._toggle_super_stab(basis, idx, super_stab)
 
             self._check()
 
@@ -281,21 +1069,14 @@ class LogicalQubit:
         if coord not in self.gauges[basis].keys():
             basis2 = "XZ"[basis == "X"]
 
-            anti_stabs = []  # coordinates of anti-commute stabilizers
-            for coord2, stab2 in self.stabs[basis2].items():
-                if coord in stab2:
-                    anti_stabs.append(coord2)
-
-            anti_super_stabs = []  # indices of anti-commute super-stabilizers
-            for idx, gauge_coords in enumerate(self.super_stabs[basis2]):
-                if coord in self.super_stabilizer(basis2, gauge_coords):
-                    anti_super_stabs.append(idx)
+            anti_stabs = self.stabs_on(basis2, coord)  # coordinates of anti-commute stabilizers
+            anti_super_stabs = self.super_stabs_on(basis2, coord)  # indices of anti-commute super-stabilizers
 
             # Information Preservation
             if anti_stabs:
                 stab = self.stabs[basis2][anti_stabs[0]]
             elif anti_super_stabs:
-                stab = self.super_stabilizer(basis2, self.super_stabs[basis2][anti_super_stabs[0]])
+                stab = self.super_stab_support(basis2, anti_super_stabs[0])
             else:
                 stab = set()
 
@@ -307,173 +1088,503 @@ class LogicalQubit:
                 if coord in edge:
                     assert stab
                     edge.symmetric_difference_update(stab)
+                    # a part of the $basis2$ graph may now lie on the edge
+                    self._dirty_components_on(basis2, stab)
 
             # Add new gauges
-            self.gauges[basis][coord] = {coord}
+            self._set_measurement("gauge", basis, coord, {coord})
             for coord2 in anti_stabs:
-                self.gauges[basis2][coord2] = self.stabs[basis2].pop(coord2)
+                self._set_measurement("gauge", basis2, coord2, self._pop_measurement("stab", basis2, coord2))
 
             # Update super-stabilizers
             if len(anti_stabs) == 2:
-                self.super_stabs[basis2].append(set(anti_stabs))
+                self._add_super_stab(basis2, set(anti_stabs))
             elif len(anti_super_stabs) == 2:
                 idx1, idx2 = anti_super_stabs
-                self.super_stabs[basis2][idx1].symmetric_difference_update(self.super_stabs[basis2].pop(idx2))
+                self._toggle_super_stab(basis2, idx1, self._pop_super_stab(basis2, idx2))
             elif len(anti_stabs) == len(anti_super_stabs) == 1:
-                self.super_stabs[basis2][anti_super_stabs[0]].add(anti_stabs[0])
+                self._add_to_super_stab(basis2, anti_super_stabs[0], anti_stabs[0])
             elif len(anti_super_stabs) == 1:
-                self.super_stabs[basis2].pop(anti_super_stabs[0])
+                self._pop_super_stab(basis2, anti_super_stabs[0])
 
     def _fix_gauge(self, basis, coord):
         # Fix gauge
-        gauge = self.gauges[basis].pop(coord)
-        self.stabs[basis][coord] = gauge
+        gauge = self._pop_measurement("gauge", basis, coord)
+        self._set_measurement("stab", basis, coord, gauge)
         # Update super-stabilizers
-        for super_stab in self.super_stabs[basis]:
-            super_stab.discard(coord)
+        for idx in list(self.super_stab_index[basis].get(coord, ())):
+            self._discard_from_super_stab(basis, idx, coord)
         # Disable gauge2 which anti-commute with gauge and super-stabilizers include gauge2
         basis2 = "XZ"[basis == "X"]
-        for coord2, gauge2 in list(self.gauges[basis2].items()):
-            if anti_commute(gauge, gauge2):
-                self.gauges[basis2].pop(coord2)
-                self.super_stabs[basis2] = [s for s in self.super_stabs[basis2] if coord2 not in s]
+        for coord2 in self._anti_commuting_gauges("stab", basis, coord):
+            self._pop_measurement("gauge", basis2, coord2)
+            for idx in list(self.super_stab_index[basis2].get(coord2, ())):
+                self._pop_super_stab(basis2, idx)
+
+    def _anti_commuting_gauges(self, kind, basis, coord):
+        # coordinates of the gauges of the other basis anti-commuting with the $basis$ $kind$ at coord,
+        # found through the gauges sharing a qubit with it
+        basis2 = "XZ"[basis == "X"]
+        support = self._measurement_tables(kind)[0][basis][coord]
+        if self.backend == "bits":
+            row = self.rows[kind][basis][coord]
+            rows2 = self.rows["gauge"][basis2]
+            neighbors = {coord2: None for q in support for coord2 in self.gauge_index[basis2].get(q, ())}
+            return [coord2 for coord2 in neighbors if gf2.anti_commute_rows(row, rows2[coord2])]
+
+        overlaps = {}
+        for q in support:
+            for coord2 in self.gauge_index[basis2].get(q, ()):
+                overlaps[coord2] = overlaps.get(coord2, 0) + 1
+        return [coord2 for coord2, overlap in overlaps.items() if overlap % 2 == 1]
+
+    def _anti_commutation_table(self, basis, basis2, coords):
+        # {coord: coordinates of the $basis2$ gauges anti-commuting with the $basis$ gauge at coord} for coords
+        if self.backend == "bits":
+            coords, coords2 = list(coords), list(self.gauges[basis2].keys())
+            table = gf2.anti_commutation_table([self.rows["gauge"][basis][coord] for coord in coords],
+                                               [self.rows["gauge"][basis2][coord2] for coord2 in coords2],
+                                               len(self.data_index))
+            return {coord: {coords2[j] for j in table[i].nonzero()[0]} for i, coord in enumerate(coords)}
+
+        return {coord: set(self._anti_commuting_gauges("gauge", basis, coord)) for coord in coords}
+
+    def _anti_commutation_rows(self, basis, basis2):
+        # anti_comm_rows[basis], with the entries of the gauges changed since the last split pass computed again
+        rows = self.anti_comm_rows[basis]
+        coords = [coord for coord in self._dirty_rows[basis] if coord in self.gauges[basis]]
+        self._dirty_rows[basis] = set()
+        rows.update(self._anti_commutation_table(basis, basis2, coords))
+        return rows
+
+    def _split_super_stab(self, anti_comm_table, position, gauge_coords, coord):
+        # Move out of gauge_coords the part of the super-stabilizer grown from coord, just popped from it: sweeps over
+        # the gauges in the order of position add every gauge anti-commuting with a gauge the part anti-commutes
+        # with, until the part commutes with all gauges of the other basis. Returns the part, built in the order of
+        # the sweeps, and the order of the gauges moved out, None if the sweeps had to run.
+        # link the gauges anti-commuting with the same gauge of the other basis
+        first, neighbors, irregular = {}, {coord: []}, False
+        for coord2 in chain([coord], gauge_coords):
+            neighbors.setdefault(coord2, [])
+            for gauge2 in anti_comm_table[coord2]:
+                coord3 = first.setdefault(gauge2, coord2)
+                if coord3 is None:
+                    irregular = True
+                elif coord3 != coord2:
+                    neighbors[coord2].append(coord3)
+                    neighbors[coord3].append(coord2)
+                    first[gauge2] = None
+
+        if irregular:
+            # rare: a gauge of the other basis anti-commutes with more than two gauges. Run the sweeps themselves,
+            # over the gauges of the super-stabilizer only.
+            order = sorted(gauge_coords, key=position.__getitem__)
+            super_stab = {coord}
+            anti_comm_gauges = anti_comm_table[coord].copy()
+            while anti_comm_gauges:
+                loop_flag = False
+                for coord in order:
+                    if coord in gauge_coords and anti_comm_table[coord].intersection(anti_comm_gauges):
+                        gauge_coords.remove(coord)
+                        super_stab.add(coord)
+                        anti_comm_gauges.symmetric_difference_update(anti_comm_table[coord])
+                        loop_flag = True
+                assert loop_flag
+            return super_stab, None
+
+        # Otherwise the part is the connected component of coord in the graph of the links. A gauge joins in the
+        # sweep of a linked gauge of the part, or in the next one if it comes first in position, so the sweep
+        # numbers are the shortest paths of a 0-1 BFS.
+        sweep = {coord: 0}
+        queue = deque([coord])
+        while queue:
+            coord2 = queue.popleft()
+            for coord3 in neighbors[coord2]:
+                step = coord2 == coord or position[coord3] < position[coord2]
+                if sweep[coord2] + step < sweep.get(coord3, math.inf):
+                    sweep[coord3] = sweep[coord2] + step
+                    if step:
+                        queue.append(coord3)
+                    else:
+                        queue.appendleft(coord3)
+        # the sweeps never end if a gauge of the other basis anti-commutes with a single gauge of the part
+        assert not any(first[gauge2] is not None for coord2 in sweep for gauge2 in anti_comm_table[coord2])
+
+        order = sorted(sweep, key=lambda coord2: (sweep[coord2], position[coord2]))[1:]
+        super_stab = {coord}
+        for coord2 in order:
+            gauge_coords.remove(coord2)
+            super_stab.add(coord2)
+        return super_stab, order
+
+    def _component_rank(self, basis, node):
+        # position of node in a sweep over stabs, gauges and super_stabs
+        if type(node) is not tuple:
+            return 2, node
+        if node in self.stabs[basis]:
+            return 0, self._order["stab"][basis][node]
+        return 1, self._order["gauge"][basis][node]
+
+    def _has_node(self, basis, node):
+        if type(node) is not tuple:
+            return node in self.super_stabs[basis]
+        return node in self.stabs[basis] or node in self.gauges[basis]
+
+    def _measurement_support(self, basis, coord):
+        return self.gauges[basis][coord] if coord in self.gauges[basis] else self.stabs[basis][coord]
+
+    def _component_neighbors(self, basis, node):
+        # nodes linked to node in the $basis$ graph: the measurements sharing with it a qubit no other measurement
+        # acts on, and the super-stabilizers including it or the gauges of the super-stabilizer
+        if type(node) is not tuple:
+            return self.super_stabs[basis][node]
+        neighbors = list(self.super_stab_index[basis].get(node, ()))
+        for q in self._measurement_support(basis, node):
+            coords = [*self.stab_index[basis].get(q, ()), *self.gauge_index[basis].get(q, ())]
+            if len(coords) == 2:
+                neighbors.append(coords[coords[0] == node])
+        return neighbors
+
+    def _component_product(self, basis, nodes):
+        support = set()
+        for coord in nodes:
+            if type(coord) is tuple:
+                support.symmetric_difference_update(self._measurement_support(basis, coord))
+        return support
+
+    def _update_components(self, basis, nodes):
+        # Bring components[basis] up to date and return the components holding nodes, the nodes dirtied since the
+        # last pass. An edge that changed joins two dirty nodes, so every node of a component holding a dirty node
+        # is linked to a dirty node by edges that did not change. Searches from the dirty nodes run side by side
+        # and merge when they meet. A search that runs out of nodes has found a whole component. Once at most one
+        # search is left, the rest of the old components holding dirty nodes and the new nodes form a single
+        # component, built from the largest of them without visiting it.
+        components = self.components[basis]
+        owner, parent, members, frontier = {}, {}, {}, {}
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for node in nodes:
+            if node not in owner:
+                owner[node] = parent[node] = node
+                members[node] = [node]
+                frontier[node] = deque([node])
+        active = set(frontier)
+        finished = []
+        while len(active) > 1:
+            for i in list(active):
+                if i not in active:
+                    continue
+                for node2 in self._component_neighbors(basis, frontier[i].popleft()):
+                    j = owner.get(node2)
+                    if j is None:
+                        owner[node2] = i
+                        members[i].append(node2)
+                        frontier[i].append(node2)
+                    elif find(j) != i:
+                        # merge the smaller search into the larger one
+                        j = find(j)
+                        if len(members[i]) < len(members[j]):
+                            i, j = j, i
+                        parent[j] = i
+                        members[i].extend(members.pop(j))
+                        frontier[i].extend(frontier.pop(j))
+                        active.discard(j)
+                if not frontier[i]:
+                    active.discard(i)
+                    finished.append(i)
+
+        touched = {components[node] for node in nodes if node in components}
+        finished = [Component(set(members[i]), self._component_product(basis, members[i])) for i in finished]
+        finished_nodes = set().union(*(component.nodes for component in finished))
+        if active:
+            new_nodes = [node for node in nodes if node not in components and node not in finished_nodes]
+            touched = sorted(touched, key=lambda component: len(component.nodes))
+            rest = touched.pop() if touched else Component(set(), set())
+            rest.nodes.difference_update(finished_nodes)
+            # the nodes leaving the old components take their supports with them
+            rest.support.symmetric_difference_update(self._component_product(
+                basis, [node for node in finished_nodes if node in components]))
+            for component in touched:
+                rest.support.symmetric_difference_update(component.support)
+                for node in component.nodes.difference(finished_nodes):
+                    rest.nodes.add(node)
+                    components[node] = rest
+            rest.support.symmetric_difference_update(self._component_product(basis, new_nodes))
+            for node in new_nodes:
+                rest.nodes.add(node)
+                components[node] = rest
+            finished.append(rest)
+        for component in finished[:len(finished) - bool(active)]:
+            for node in component.nodes:
+                components[node] = component
+        return finished
+
+    def _delete_separate_parts(self, basis):
+        # Delete the data qubits of the components of the $basis$ graph whose product lies on an edge. A component
+        # holding no node dirtied since the last pass is the same as then and was not deletable, so only the dirty
+        # ones are examined, in the order a sweep over the nodes would meet them. A component after the current one
+        # that a deletion changes is examined too. Returns True if a component was deleted.
+        if self.check_mode == "sweep":
+            self.components[basis] = {}
+            nodes = list(chain(self.stabs[basis], self.gauges[basis], self.super_stabs[basis]))
+        else:
+            nodes = [node for node in self._dirty_components[basis] if self._has_node(basis, node)]
+        self._dirty_components[basis] = set()
+        components = self._update_components(basis, nodes)
+
+        ranks = {}
+
+        def rank(component):
+            if component not in ranks:
+                ranks[component] = min(self._component_rank(basis, node) for node in component.nodes)
+            return ranks[component]
+
+        deleted = False
+        while True:
+            deletable = [component for component in components
+                         if any(component.support.issubset(self.edges[basis][k]) for k in range(2))]
+            if not deletable:
+                return deleted
+            component = min(deletable, key=rank)
+            data_qubits_component = set().union(*(self._measurement_support(basis, coord) for coord in component.nodes
+                                                  if type(coord) is tuple))
+            # delete data_qubits_component. difference_update resizes a set holding too many deleted entries, even one
+            # it does not change, so every measurement goes through it like in the original pass: the tables of the
+            # sets decide what set.pop() returns later on.
+            for basis2 in "XZ":
+                for kind in ("stab", "gauge"):
+                    measurements, index = self._measurement_tables(kind)
+                    for q in data_qubits_component:
+                        for coord in list(index[basis2].get(q, ())):
+                            self._unindex(index[basis2], q, coord)
+                            self._dirty_support(kind, basis2, coord, q)
+                    for measurement in measurements[basis2].values():
+                        measurement.difference_update(data_qubits_component)
+                for coords in chain([self.observable[basis2]], self.edges[basis2]):
+                    coords.difference_update(data_qubits_component)
+            deleted = True
+            # the components before this one were examined before the deletion, the others see it
+            after = rank(component)
+            dirtied = [self.components[basis][node] for node in self._dirty_components[basis]
+                       if node in self.components[basis]]
+            components = {component2 for component2 in chain(components, dirtied) if rank(component2) > after}
+
+    def _update_qubit_coords(self):
+        # data_coords is the union of the measurements and observables, qubit_coords adds the measurement qubits.
+        # Only the coordinates dirtied since the last update can have joined or left them.
+        coords = self._dirty_coords.union(self.qubit_coords) if self.check_mode == "sweep" else self._dirty_coords
+        self._dirty_coords = set()
+        data_coords = {q for q in coords
+                       if any(q in index[basis] for index in (self.stab_index, self.gauge_index) for basis in "XZ")
+                       or any(q in self.observable[basis] for basis in "XZ")}
+        qubit_coords = data_coords.union(q for q in coords
+                                         if any(q in measurements[basis] for measurements in (self.stabs, self.gauges)
+                                                for basis in "XZ"))
+        for coords2, new_coords in ((self.data_coords, data_coords), (self.qubit_coords, qubit_coords)):
+            removed = coords.intersection(coords2).difference(new_coords)
+            added = new_coords.difference(coords2)
+            if removed or added:
+                coords2.difference_update(removed)
+                coords2.update(added)
+        self._index_qubits(qubit_coords)
+
+    def _networkx_components(self, basis):
+        # Reference implementation of the components of _delete_separate_parts on a networkx graph: all the
+        # components of the $basis$ graph, and those whose product lies on an edge
+        import networkx as nx
+        measurements = {**self.stabs[basis], **self.gauges[basis]}
+        G = nx.Graph()
+        G.add_nodes_from(measurements.keys())
+
+        G_edges = {q: set() for q in self.data_coords}
+        for coord, measurement in measurements.items():
+            for q in measurement:
+                G_edges[q].add(coord)
+        for q in self.data_coords:
+            if len(G_edges[q]) == 2:
+                G.add_edge(*G_edges[q])
+
+        for idx, gauge_coords in self.super_stabs[basis].items():
+            G.add_node(idx)
+            for coord in gauge_coords:
+                G.add_edge(idx, coord)
+
+        components = list(nx.connected_components(G))
+        deletable = []
+        for component in components:
+            super_stab = set()
+            for coord in component:
+                if type(coord) is tuple:
+                    super_stab.symmetric_difference_update(measurements[coord])
+            if any(super_stab.issubset(self.edges[basis][k]) for k in range(2)):
+                deletable.append(component)
+        return components, deletable
 
     def _check(self):
         flag = True
         while flag:
             flag = False
 
-            for coord in self.data_coords:
-                if all(coord in self.gauges[basis].keys() for basis in "XZ"):
+            coords = self.data_coords if self.check_mode == "sweep" else self._dirty_data.intersection(self.data_coords)
+            self._dirty_data = set()
+            for coord in coords:
+                if all(coord in self.gauges[basis] for basis in "XZ"):
                     for basis in "XZ":
-                        for gauge in self.gauges[basis].values():
-                            gauge.discard(coord)
+                        for coord2 in self.gauges_on(basis, coord):
+                            self._discard_qubit("gauge", basis, coord2, coord)
                     flag = True
 
-            for basis, basis2 in ["XZ", "ZX"]:
-                used_gauges = set.union(*self.super_stabs[basis]) if self.super_stabs[basis] else set()
-                for coord, gauge in list(self.gauges[basis].items()):
-                    if not any(anti_commute(gauge, gauge2) for gauge2 in self.gauges[basis2].values()):
+            for basis in "XZ":
+                for coord in self._worklist("gauge", basis):
+                    if not self._anti_commuting_gauges("gauge", basis, coord):
                         # Fix a gauge if it is a stabilizer
                         self._fix_gauge(basis, coord)
                         flag = True
-                    elif coord not in used_gauges:
+                    elif coord not in self.super_stab_index[basis]:
                         # Remove unused gauges
-                        self.gauges[basis].pop(coord)
+                        self._pop_measurement("gauge", basis, coord)
                         flag = True
 
             for basis in "XZ":
                 # Update self.gauges
-                for coord, gauge in list(self.gauges[basis].items()):
+                for coord in self._worklist("gauge_size", basis):
+                    gauge = self.gauges[basis][coord]
                     if len(gauge) == 1 and gauge != {coord}:
-                        q = gauge.pop()
-                        self.gauges[basis][q] = {q}
-                        for super_stab in self.super_stabs[basis]:
-                            if coord in super_stab:
-                                super_stab.symmetric_difference_update({q})
+                        q = self._pop_qubit("gauge", basis, coord)
+                        self._set_measurement("gauge", basis, q, {q})
+                        for idx in list(self.super_stab_index[basis].get(coord, ())):
+                            self._toggle_super_stab(basis, idx, {q})
                         flag = True
                     if len(gauge) == 0:
-                        self.gauges[basis].pop(coord)
-                        for super_stab in self.super_stabs[basis]:
-                            super_stab.discard(coord)
+                        self._pop_measurement("gauge", basis, coord)
+                        for idx in list(self.super_stab_index[basis].get(coord, ())):
+                            self._discard_from_super_stab(basis, idx, coord)
 
                 # Update self.stabs
-                for coord, stab in list(self.stabs[basis].items()):
+                for coord in self._worklist("stab", basis):
+                    stab = self.stabs[basis][coord]
                     if len(stab) == 1:
-                        q = stab.pop()
-                        for measurement in chain(self.stabs[basis].values(), self.gauges[basis].values()):
-                            measurement.discard(q)
-                        self.observable[basis].discard(q)
-                        for k in range(2):
-                            self.edges[basis][k].discard(q)
+                        q = self._pop_qubit("stab", basis, coord)
+                        for coord2 in self.stabs_on(basis, q):
+                            self._discard_qubit("stab", basis, coord2, q)
+                        for coord2 in self.gauges_on(basis, q):
+                            self._discard_qubit("gauge", basis, coord2, q)
+                        for coords in chain([self.observable[basis]], self.edges[basis]):
+                            if q in coords:
+                                coords.discard(q)
                         flag = True
                     if len(stab) == 0:
-                        self.stabs[basis].pop(coord)
+                        self._pop_measurement("stab", basis, coord)
 
                 # Update self.super_stabs
-                self.super_stabs[basis] = [super_stab for super_stab in self.super_stabs[basis] if super_stab]
+                idxs = self.super_stabs[basis].keys() if self.check_mode == "sweep" else self._dirty["super_stab"][basis]
+                for idx in sorted(idx for idx in idxs if idx in self.super_stabs[basis] and not self.super_stabs[basis][idx]):
+                    self._pop_super_stab(basis, idx)
+                self._dirty["super_stab"][basis] = set()
 
-            ## the following two parts are just for the special case which occurs when defect size is large. It is time-costing and can be removed when defects are not denese.
+            ## the following two parts are just for the special case which occurs when defect size is large. They can be removed when defects are not denese.
 
             # Split super-stabilizer
             if not flag:
                 for basis, basis2 in ["XZ", "ZX"]:
-                    anti_comm_table = {coord: set() for coord in self.gauges[basis].keys()}  # {basis: {basis2}}
-                    for coord, gauge in self.gauges[basis].items():
-                        for coord2, gauge2 in self.gauges[basis2].items():
-                            if anti_commute(gauge, gauge2):
-                                anti_comm_table[coord].add(coord2)
-
-                    for gauge_coords in self.super_stabs[basis]:
+                    # the split orders of the super-stabilizers whose gauges, their anti-commutations or their ranks
+                    # changed since the last split pass are stale
+                    dirty = self._dirty_super_stabs[basis]
+                    self._dirty_super_stabs[basis] = set()
+                    for coord in self._dirty_rows[basis]:
+                        dirty.update(self.super_stab_index[basis].get(coord, ()))
+                    split_orders = self.split_orders[basis]
+                    for idx in dirty:
+                        split_orders.pop(idx, None)
+                    anti_comm_table = self._anti_commutation_rows(basis, basis2)  # {basis: {basis2}}
+                    # anti_comm_table is in no particular order, the ranks give the order of self.gauges[basis]
+                    position = self._order["gauge"][basis]
+
+                    super_stab_idxs = list(self.super_stabs[basis].keys())
+                    for idx in super_stab_idxs:
+                        gauge_coords = self.super_stabs[basis][idx]
                         coord = gauge_coords.pop()
-                        super_stab = {coord}
-                        anti_comm_gauges = anti_comm_table[coord].copy()
-                        while anti_comm_gauges:
-                            loop_flag = False
-                            for coord, gauges2 in anti_comm_table.items():
-                                if coord not in super_stab and coord in gauge_coords and gauges2.intersection(
-                                        anti_comm_gauges):
-                                    gauge_coords.remove(coord)
-                                    super_stab.add(coord)
-                                    anti_comm_gauges.symmetric_difference_update(gauges2)
-                                    loop_flag = True
-                            assert loop_flag
+                        order = split_orders.get(idx, {}).get(coord)
+                        if order is not None and self.split_mode == "adaptive":
+                            super_stab = {coord}
+                            for coord2 in order:
+                                gauge_coords.remove(coord2)
+                                super_stab.add(coord2)
+                        else:
+                            super_stab, order2 = self._split_super_stab(anti_comm_table, position, gauge_coords, coord)
+                            assert order is None or (order2 == order and not gauge_coords), idx
+                            if order2 is not None and not gauge_coords and self.split_mode != "always":
+                                split_orders.setdefault(idx, {})[coord] = order2
 
                         if gauge_coords:
-                            self.super_stabs[basis].append(super_stab)
+                            for coord in super_stab:
+                                self._unindex(self.super_stab_index[basis], coord, idx)
+                            idx2 = self._add_super_stab(basis, super_stab)
+                            self.super_stab_supports[basis][idx].symmetric_difference_update(self.super_stab_supports[basis][idx2])
+                            self._dirty_components[basis].add(idx)
+                            self._dirty_super_stabs[basis].add(idx)
+                            super_stab_idxs.append(idx2)
                             flag = True
                         else:
                             gauge_coords.update(super_stab)
 
             # delete seperate part
             if not flag:
-                measurements = {basis:{**self.stabs[basis], **self.gauges[basis]} for basis in "XZ"}
                 for basis in "XZ":
-                    G = nx.Graph()
-                    G.add_nodes_from(measurements[basis].keys())
-
-                    G_edges = {q: set() for q in self.data_coords}
-                    for coord, measurement in measurements[basis].items():
-                        for q in measurement:
-                            G_edges[q].add(coord)
-                    for q in self.data_coords:
-                        if len(G_edges[q]) == 2:
-                            G.add_edge(*G_edges[q])
-
-                    for idx, gauge_coords in enumerate(self.super_stabs[basis]):
-                        G.add_node(idx)
-                        for coord in gauge_coords:
-                            G.add_edge(idx, coord)
-
-                    for component in list(nx.connected_components(G)):
-                        data_qubits_component = set().union(*(measurements[basis][coord] for coord in component if type(coord) is tuple))
-
-                        super_stab = set()
-                        for coord in component:
-                            if type(coord) is tuple:
-                                super_stab.symmetric_difference_update(measurements[basis][coord])
-
-                        if any(super_stab.issubset(self.edges[basis][k]) for k in range(2)):
-                            # delete data_qubits_component
-                            for basis2 in "XZ":
-                                for measurement in measurements[basis2].values():
-                                    measurement.difference_update(data_qubits_component)
-                                for k in range(2):
-                                    self.edges[basis2][k].difference_update(data_qubits_component)
-                                self.observable[basis2].difference_update(data_qubits_component)
-                            flag = True
-                        # else:
-                        #     assert all(self.corners[i][j] in data_qubits_component for i, j in product(range(2), repeat=2))
-
-                self.data_coords = set().union(*(m for basis in "XZ" for m in chain(self.stabs[basis].values(),
-                                                                                    self.gauges[basis].values(),
-                                                                                    [self.observable[basis]],
-                                                                                    )))
-
-                self.qubit_coords = self.data_coords.union(*(set(chain(self.stabs[basis].keys(),
-                                                                       self.gauges[basis].keys())) for basis in "XZ"))
+                    if self._delete_separate_parts(basis):
+                        flag = True
+                self._update_qubit_coords()
         for i, j in product(range(2), repeat=2):
             assert not self.edges["X"][i].intersection(self.edges["Z"][j]).difference({self.corners[i][j]})
+        if self.check_mode == "verify":
+            self._verify_check()
+
+    def _verify_check(self):
+        # A sweep over the whole patch must find nothing left to do after an incremental _check
+        for coord in self.data_coords:
+            assert not all(coord in self.gauges[basis] for basis in "XZ"), coord
+        for basis in "XZ":
+            for coord, gauge in self.gauges[basis].items():
+                assert self._anti_commuting_gauges("gauge", basis, coord) and coord in self.super_stab_index[basis], coord
+                assert len(gauge) > 1 or gauge == {coord}, coord
+            for coord, stab in self.stabs[basis].items():
+                assert len(stab) > 1, coord
+            assert all(self.super_stabs[basis].values())
+            for idx, gauge_coords in self.super_stabs[basis].items():
+                assert self.super_stab_supports[basis][idx] == self.super_stabilizer(basis, gauge_coords), idx
+
+        # No part is left to delete, and the coordinate sets match their recomputation
+        for basis in "XZ":
+            components, deletable = self._networkx_components(basis)
+            assert not deletable, basis
+            assert {frozenset(component) for component in components} == {
+                frozenset(component.nodes) for component in self.components[basis].values()}, basis
+            for node, component in self.components[basis].items():
+                assert node in component.nodes and component.support == self._component_product(basis, component.nodes)
+        assert self.data_coords == set().union(*(m for basis in "XZ" for m in chain(
+            self.stabs[basis].values(), self.gauges[basis].values(), [self.observable[basis]])))
+        assert self.qubit_coords == self.data_coords.union(*(chain(self.stabs[basis], self.gauges[basis])
+                                                             for basis in "XZ"))
+
+        # The reverse indices must match the measurements they index
+        for basis in "XZ":
+            for measurements, index in [(self.stabs[basis], self.stab_index[basis]),
+                                        (self.gauges[basis], self.gauge_index[basis])]:
+                expected = {}
+                for coord, support in measurements.items():
+                    for q in support:
+                        expected.setdefault(q, set()).add(coord)
+                assert expected == {q: set(coords) for q, coords in index.items()}
+            expected = {}
+            for idx, gauge_coords in self.super_stabs[basis].items():
+                for coord in gauge_coords:
+                    expected.setdefault(coord, set()).add(idx)
+            assert expected == {coord: set(idxs) for coord, idxs in self.super_stab_index[basis].items()}
 
 if __name__ == "__main__":
     d = 15
@@ -0,0 +1,102 @@
+from code_deformation import LogicalQubit
+from collections import Counter
+import json
+import multiprocessing
+import numpy as np
+import time
+
+# Undeformed patches of the worker process, forked for each configuration
+_base_patches = {}
+
+
+def _base_patch(distance):
+    if distance not in _base_patches:
+        _base_patches[distance] = LogicalQubit(distance, True)
+    return _base_patches[distance]
+
+
+def sample_defects(distance, data_rate, ancilla_rate, rng):
+    # Each data qubit of the undeformed patch is a defect with probability data_rate, each ancilla with ancilla_rate
+    base = _base_patch(distance)
+    data_coords = sorted(base.data_coords)
+    ancilla_coords = sorted(coord for basis in "XZ" for coord in base.stabs[basis].keys())
+    return ([data_coords[i] for i in np.flatnonzero(rng.random(len(data_coords)) < data_rate)] +
+            [ancilla_coords[i] for i in np.flatnonzero(rng.random(len(ancilla_coords)) < ancilla_rate)])
+
+
+def configuration_defects(distance, data_rate, ancilla_rate, seed, index):
+    # Defects of the index-th configuration of the ensemble. They only depend on (seed, index), not on how the
+    # configurations are spread over the workers.
+    rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(index,)))
+    return sample_defects(distance, data_rate, ancilla_rate, rng)
+
+
+def deform(distance, defects):
+    logical_qubit = _base_patch(distance).fork()
+    for coord in defects:
+        logical_qubit.disable(coord)
+    logical_qubit.update_distance()
+    return logical_qubit
+
+
+def run_configuration(distance, data_rate, ancilla_rate, seed, index):
+    # Deform the index-th configuration of the ensemble
+    defects = configuration_defects(distance, data_rate, ancilla_rate, seed, index)
+    result = {"index": index, "defects": [list(coord) for coord in defects]}
+    start = time.perf_counter()
+    try:
+        logical_qubit = deform(distance, defects)
+    except Exception as e:
+        result.update(error=repr(e), seconds=time.perf_counter() - start)
+        return result
+    result.update(
+        distance_x=logical_qubit.distance["X"],
+        distance_z=logical_qubit.distance["Z"],
+        logicals_x=logical_qubit.logical_counts["X"],
+        logicals_z=logical_qubit.logical_counts["Z"],
+        data_qubits=len(logical_qubit.data_coords),
+        qubits=len(logical_qubit.qubit_coords),
+        stabs=sum(len(logical_qubit.stabs[basis]) for basis in "XZ"),
+        gauges=sum(len(logical_qubit.gauges[basis]) for basis in "XZ"),
+        super_stabs=sum(len(logical_qubit.super_stabs[basis]) for basis in "XZ"),
+        seconds=time.perf_counter() - start,
+    )
+    return result
+
+
+def _run_chunk(args):
+    distance, data_rate, ancilla_rate, seed, indices = args
+    return [run_configuration(distance, data_rate, ancilla_rate, seed, index) for index in indices]
+
+
+def summarize(results):
+    distances = Counter((result["distance_x"], result["distance_z"]) for result in results if "error" not in result)
+    summary = {"configurations": len(results), "failures": sum(1 for result in results if "error" in result),
+               "distances": dict(sorted(distances.items()))}
+    for basis in "xz":
+        values = np.array([result["distance_" + basis] for result in results if "error" not in result])
+        if len(values):
+            summary["distance_" + basis] = {"min": int(values.min()), "mean": float(values.mean()),
+                                            "max": int(values.max())}
+    return summary
+
+
+def run_ensemble(distance, data_rate, ancilla_rate, num_configurations, path, seed=0, processes=None, chunk_size=16):
+    # Deform num_configurations random defect maps on a process pool and append one JSON line per configuration to
+    # path as the results come in. Configurations that raise are recorded with their error instead of a distance.
+    chunks = [(distance, data_rate, ancilla_rate, seed, range(start, min(start + chunk_size, num_configurations)))
+              for start in range(0, num_configurations, chunk_size)]
+    results = []
+    with open(path, "a") as f, multiprocessing.Pool(processes) as pool:
+        for chunk in pool.imap_unordered(_run_chunk, chunks):
+            for result in chunk:
+                f.write(json.dumps(result) + "\n")
+            f.flush()
+            results += chunk
+    return summarize(results)
+
+
+if __name__ == "__main__":
+    d = 15
+    summary = run_ensemble(d, 0.02, 0.02, 200, "ensemble_d%d.jsonl" % d, seed=1)
+    print(summary)
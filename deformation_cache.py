@@ -0,0 +1,79 @@
+from code_deformation import LogicalQubit
+from collections import OrderedDict
+import hashlib
+import os
+import pickle
+import tempfile
+
+# Bump when a change of the deformation engine makes stored patches stale
+CACHE_VERSION = 3
+
+
+class DeformationCache:
+    # Deformed patches keyed by (distance, defect set), kept in an in-memory LRU and, if path is given, on disk.
+    # The patch of a defect set is the one of disable() on each defect in sorted order, followed by
+    # update_distance(). The patch the engine makes depends on the order of the defects, so a lookup gives the
+    # state() of deforming the sorted defects, not of another order of the same set.
+    def __init__(self, path=None, maxsize=1024):
+        self.path = path
+        self.maxsize = maxsize
+        self.memory = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+
+    @staticmethod
+    def canonical(defects):
+        # the defects without repetitions, in the order they are disabled in
+        return sorted({tuple(q) for q in defects})
+
+    def key(self, distance, canonical_defects):
+        text = repr((CACHE_VERSION, "rotated", distance, canonical_defects))
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def deform(self, distance, defects, check_mode="incremental", backend="set"):
+        canonical_defects = self.canonical(defects)
+        key = self.key(distance, canonical_defects)
+        state = self._get(key)
+        if state is None:
+            self.misses += 1
+            logical_qubit = LogicalQubit(distance, True, check_mode, backend)
+            for coord in canonical_defects:
+                logical_qubit.disable(coord)
+            logical_qubit.update_distance()
+            state = logical_qubit.state()
+            self._put(key, state)
+        return LogicalQubit.from_state(state, check_mode, backend)
+
+    def _get(self, key):
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.hits += 1
+            return self.memory[key]
+        if self.path is not None:
+            try:
+                with open(os.path.join(self.path, key + ".pkl"), "rb") as f:
+                    state = pickle.load(f)
+            except FileNotFoundError:
+                return None
+            self.disk_hits += 1
+            self._remember(key, state)
+            return state
+        return None
+
+    def _put(self, key, state):
+        self._remember(key, state)
+        if self.path is not None:
+            # write to a temporary file first so that concurrent readers never see a partial entry
+            fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, os.path.join(self.path, key + ".pkl"))
+
+    def _remember(self, key, state):
+        self.memory[key] = state
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.maxsize:
+            self.memory.popitem(last=False)
@@ -0,0 +1,66 @@
+from collections import OrderedDict
+import hashlib
+import os
+import stim
+import tempfile
+
+
+class DemCache:
+    # Decomposed detector error models of circuits, keyed by the hash of the circuit text and of the stim version.
+    # The models are kept in an in-memory LRU together with their matchers and, if path is given, on disk, so that
+    # a circuit seen before skips both the model extraction and the matcher construction.
+    def __init__(self, path=None, maxsize=64):
+        self.path = path
+        self.maxsize = maxsize
+        # key -> [detector error model, matcher or None]
+        self.memory = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+
+    def key(self, circuit):
+        text = stim.__version__ + "\n" + str(circuit)
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def detector_error_model(self, circuit):
+        return self._entry(self.key(circuit), circuit)[0]
+
+    def matcher(self, circuit):
+        # pymatching decoder of the circuit, built at most once while the circuit stays in the LRU
+        entry = self._entry(self.key(circuit), circuit)
+        if entry[1] is None:
+            import pymatching
+            entry[1] = pymatching.Matching.from_detector_error_model(entry[0])
+        return entry[1]
+
+    def _entry(self, key, circuit):
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.hits += 1
+            return self.memory[key]
+        dem = self._load(key)
+        if dem is not None:
+            self.disk_hits += 1
+        else:
+            self.misses += 1
+            dem = circuit.detector_error_model(decompose_errors=True)
+            self._store(key, dem)
+        entry = self.memory[key] = [dem, None]
+        while len(self.memory) > self.maxsize:
+            self.memory.popitem(last=False)
+        return entry
+
+    def _load(self, key):
+        if self.path is None or not os.path.exists(os.path.join(self.path, key + ".dem")):
+            return None
+        return stim.DetectorErrorModel.from_file(os.path.join(self.path, key + ".dem"))
+
+    def _store(self, key, dem):
+        if self.path is not None:
+            # write to a temporary file first so that concurrent readers never see a partial entry
+            fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+            os.close(fd)
+            dem.to_file(tmp_path)
+            os.replace(tmp_path, os.path.join(self.path, key + ".dem"))
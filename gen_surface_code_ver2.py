@@ -38,7 +38,7 @@ def _generate_unshell_surface_code_circuit(params, logical_qubit, is_memory_z: b
 
     # Make target lists for various types of qubits.
     data_qubits = sorted([p2q[p] for p in data_coords])
-    ano_qubits = sorted([p2q[p] for p in ano_coords])
+    ano_qubits = frozenset(p2q[p] for p in ano_coords)
     stab_qubits = {basis: sorted([p2q[p] for p in stab_coords[basis]]) for basis in "XZ"}
     gauge_ancilla_qubits = {basis: sorted([p2q[p] for p in gauge_coords[basis] if p not in data_coords]) for basis in "XZ"}
     gauge_data_qubits = {basis: sorted([p2q[p] for p in gauge_coords[basis] if p in data_coords]) for basis in "XZ"}
@@ -107,7 +107,7 @@ def _generate_unshell_surface_code_circuit(params, logical_qubit, is_memory_z: b
     def _generate_gauge_detectors(is_gauge_z):
         detectors = stim.Circuit()
         basis = "XZ"[is_gauge_z]
-        for super_stab in logical_qubit.super_stabs[basis]:
+        for super_stab in logical_qubit.super_stabs[basis].values():
             detectors.append(
                 "DETECTOR",
                 [record.measure_rec((basis, "gauge", p2q[coord]), -1) for coord in super_stab] +
@@ -129,7 +129,7 @@ def _generate_unshell_surface_code_circuit(params, logical_qubit, is_memory_z: b
             [record.measure_rec((chosen_basis, "stab", p2q[coord]), -1)],
             coord + (0,)
         )
-    for super_stab in logical_qubit.super_stabs[chosen_basis]:
+    for super_stab in logical_qubit.super_stabs[chosen_basis].values():
         head.append(
             "DETECTOR",
             [record.measure_rec((chosen_basis, "gauge", p2q[coord]), -1) for coord in super_stab],
@@ -164,7 +164,7 @@ def _generate_unshell_surface_code_circuit(params, logical_qubit, is_memory_z: b
             [record.measure_rec((chosen_basis, "stab", p2q[coord]), -1)],
             coord + (1,)
         )
-    for super_stab in logical_qubit.super_stabs[chosen_basis]:
+    for super_stab in logical_qubit.super_stabs[chosen_basis].values():
         detector = []
         for coord in super_stab:
             for act_coord in logical_qubit.gauges[chosen_basis][coord]:
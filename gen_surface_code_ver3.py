@@ -1,88 +1,140 @@
-from circuit_gen_params import CircuitGenParameters
+from circuit_gen_params import CircuitGenParameters, qubit_rate_array
 from code_deformation import LogicalQubit
-from itertools import chain
+from itertools import product
+import numpy as np
 import stim
 
 
 class MeasurementRecord:
+    # Each measured (basis, kind, qubit) key gets an integer id, and last[id] holds the indices of its last two
+    # measurements in the circuit, -1 if there are none
     def __init__(self):
         self.t = 0
-        self.record = {}
+        self.ids = {}
+        self.last = np.full((0, 2), -1, dtype=np.int64)
+
+    def key_ids(self, measurements):
+        measurements = list(measurements)
+        for measurement in measurements:
+            self.ids.setdefault(measurement, len(self.ids))
+        if len(self.ids) > len(self.last):
+            self.last = np.vstack([self.last, np.full((len(self.ids) - len(self.last), 2), -1, dtype=np.int64)])
+        return np.array([self.ids[measurement] for measurement in measurements], dtype=np.int64)
 
     def measure(self, measurements):
-        for i, measurement in enumerate(measurements):
-            try:
-                self.record[measurement].append(self.t + i)
-            except KeyError:
-                self.record[measurement] = [self.t + i]
-        self.t += len(measurements)
+        ids = self.key_ids(measurements)
+        self.last[ids, 1] = self.last[ids, 0]
+        self.last[ids, 0] = self.t + np.arange(len(ids))
+        self.t += len(ids)
+
+    def lookbacks(self, ids, idx):
+        # rec offsets of the last (idx = -1) or second to last (idx = -2) measurements of ids
+        times = self.last[ids, -1 - idx]
+        if (times < 0).any():
+            raise KeyError("Measurement %d of a key was not recorded." % idx)
+        return times - self.t
 
     def measure_rec(self, measurement, idx):
-        return stim.target_rec(self.record[measurement][idx] - self.t)
+        return stim.target_rec(int(self.lookbacks(self.key_ids([measurement]), idx)[0]))
+
+
+def _instructions(name, rows, args, target="rec[%d]"):
+    # Circuit of one $name$ instruction per row of targets (rec offsets by default), with the matching arguments.
+    # Parsing them at once is much faster than appending them one at a time.
+    return stim.Circuit("\n".join("%s(%s) %s" % (name, ", ".join(map(str, arg)), " ".join(target % x for x in row))
+                                  for row, arg in zip(rows, args)))
 
 
-def _generate_unshell_surface_code_circuit(params, logical_qubit, is_memory_z: bool):
+def _split(values, lengths):
+    # values cut into consecutive pieces of the given lengths
+    ends = np.cumsum(lengths).tolist()
+    values = values.tolist()
+    return [values[end - length:end] for end, length in zip(ends, lengths)]
+
+
+def _generate_unshell_surface_code_circuit(params, logical_qubit, is_memory_z: bool, burst_events=()):
     if params.rounds < 1:
         raise AttributeError("Need rounds >= 1.")
 
     chosen_basis = "XZ"[is_memory_z]
-    data_coords = logical_qubit.data_coords
-    ano_coords = logical_qubit.ano_coords
-    stab_coords = {basis: set(coord for coord in logical_qubit.stabs[basis].keys()) for basis in "XZ"}
-    gauge_coords = {basis: set(coord for coord in logical_qubit.gauges[basis].keys()) for basis in "XZ"}
-
-    # Index the measurement qubits and data qubits.
-    p2q = {}
-    for p in chain(logical_qubit.qubit_coords, logical_qubit.ano_coords):
-        p2q[p] = logical_qubit.coord_to_index(p)
+    # The patch in qubit ids, shared by every circuit generated from it until it changes
+    qubit_table = logical_qubit.qubit_table
+    arrays = logical_qubit.qubit_arrays()
+    is_data = np.zeros(len(qubit_table), dtype=bool)
+    is_data[arrays.data] = True
 
     # Make target lists for various types of qubits.
-    data_qubits = sorted([p2q[p] for p in data_coords])
-    ano_qubits = sorted([p2q[p] for p in ano_coords])
-    stab_qubits = {basis: sorted([p2q[p] for p in stab_coords[basis]]) for basis in "XZ"}
-    gauge_ancilla_qubits = {basis: sorted([p2q[p] for p in gauge_coords[basis] if p not in data_coords]) for basis in "XZ"}
-    gauge_data_qubits = {basis: sorted([p2q[p] for p in gauge_coords[basis] if p in data_coords]) for basis in "XZ"}
+    data_qubits = arrays.data.tolist()
+    ano_qubits = frozenset(arrays.ano.tolist())
+    stab_qubits = {basis: np.sort(arrays.measurements["stab"][basis]).tolist() for basis in "XZ"}
+    gauge_qubits = {basis: np.sort(arrays.measurements["gauge"][basis]) for basis in "XZ"}
+    gauge_ancilla_qubits = {basis: gauge_qubits[basis][~is_data[gauge_qubits[basis]]].tolist() for basis in "XZ"}
+    gauge_data_qubits = {basis: gauge_qubits[basis][is_data[gauge_qubits[basis]]].tolist() for basis in "XZ"}
 
     # List out CNOT gate targets using given interaction orders.
     order = {"X": [(1, 1), (-1, 1), (1, -1), (-1, -1)],
              "Z": [(1, 1), (1, -1), (-1, 1), (-1, -1)]}
-    stab_cnot_targets = [[] for _ in range(4)]
-    gauge_cnot_targets = {basis: [[] for _ in range(4)] for basis in "XZ"}
-    for k in range(4):
-        for basis in "XZ":
-            for coord in logical_qubit.stabs[basis].keys():
-                data = (coord[0] + order[basis][k][0], coord[1] + order[basis][k][1])
-                if data in logical_qubit.stabs[basis][coord]:
-                    stab_cnot_targets[k].append(p2q[coord if basis == "X" else data])
-                    stab_cnot_targets[k].append(p2q[data if basis == "X" else coord])
-            for coord in logical_qubit.gauges[basis].keys():
-                data = (coord[0] + order[basis][k][0], coord[1] + order[basis][k][1])
-                if data in logical_qubit.gauges[basis][coord]:
-                    gauge_cnot_targets[basis][k].append(p2q[coord if basis == "X" else data])
-                    gauge_cnot_targets[basis][k].append(p2q[data if basis == "X" else coord])
+    cnot_pairs = {}
+    for kind, basis in product(("stab", "gauge"), "XZ"):
+        # each measurement acts on at most one qubit in each direction, so the pairs of a direction follow the
+        # order of the measurements
+        indptr, support = arrays.supports[kind][basis]
+        coords = np.repeat(arrays.measurements[kind][basis], np.diff(indptr))
+        (x, y), (x2, y2) = qubit_table.xy(coords), qubit_table.xy(support)
+        pairs = np.stack([coords, support] if basis == "X" else [support, coords], axis=1)
+        cnot_pairs[kind, basis] = [pairs[(x2 - x == dx) & (y2 - y == dy)].ravel().tolist() for dx, dy in order[basis]]
+    stab_cnot_targets = [cnot_pairs["stab", "X"][k] + cnot_pairs["stab", "Z"][k] for k in range(4)]
+    gauge_cnot_targets = {basis: cnot_pairs["gauge", basis] for basis in "XZ"}
 
     # Build the repeated actions that make up the surface code cycle.
     record = MeasurementRecord()
 
-    def _generate_cycle_actions(is_gauge_z):
+    # Measurement ids of the detectors, in the order of their records.
+    stab_ids = {basis: record.key_ids([(basis, "stab", q) for q in arrays.measurements["stab"][basis].tolist()])
+                for basis in "XZ"}
+    stab_detector_coords = {basis: [qubit_table.coords[q] + (0,) for q in arrays.measurements["stab"][basis].tolist()]
+                            for basis in "XZ"}
+    super_stab_ids = {basis: record.key_ids([(basis, "gauge", q) for q in arrays.super_stabs[basis][1].tolist()])
+                      for basis in "XZ"}
+    super_stab_lengths = {basis: np.diff(arrays.super_stabs[basis][0]).tolist() for basis in "XZ"}
+
+    # Rounds with the same burst events share their parameters.
+    burst_coords = [logical_qubit.burst_qubits(event.center, event.radius) for event in burst_events]
+    round_params = {(): params}
+
+    def _round_params(round_index):
+        # (key, parameters) of a round, where the active burst events raise the depolarization of their qubits
+        rates = {}
+        for event, coords in zip(burst_events, burst_coords):
+            rate = event.rate(round_index)
+            if rate > 0:
+                for coord in coords:
+                    rates[coord] = max(rates.get(coord, 0), rate)
+        key = tuple(sorted(rates.items()))
+        if key not in round_params:
+            round_params[key] = params.with_qubit_depolarization(qubit_rate_array(logical_qubit, rates))
+        return key, round_params[key]
+
+    def _generate_cycle_actions(is_gauge_z, cycle_params):
         cycle_actions = stim.Circuit()
         gauge_basis = "XZ"[is_gauge_z]
         x_qubits = stab_qubits["X"] + ([] if is_gauge_z else gauge_ancilla_qubits["X"])
-        params.append_reset(cycle_actions, stab_qubits["X"] + stab_qubits["Z"] + gauge_ancilla_qubits[gauge_basis])
-        params.append_begin_round_tick(cycle_actions, data_qubits, ano_qubits)
-        params.append_unitary_1(cycle_actions, "H", x_qubits, ano_qubits)
+        cycle_params.append_reset(cycle_actions,
+                                  stab_qubits["X"] + stab_qubits["Z"] + gauge_ancilla_qubits[gauge_basis])
+        cycle_params.append_begin_round_tick(cycle_actions, data_qubits, ano_qubits)
+        cycle_params.append_unitary_1(cycle_actions, "H", x_qubits, ano_qubits)
         for k in range(4):
             cycle_actions.append("TICK")
-            params.append_unitary_2(cycle_actions, "CNOT",
-                                    stab_cnot_targets[k] + gauge_cnot_targets[gauge_basis][k], ano_qubits)
+            cycle_params.append_unitary_2(cycle_actions, "CNOT",
+                                          stab_cnot_targets[k] + gauge_cnot_targets[gauge_basis][k], ano_qubits)
         cycle_actions.append("TICK")
-        params.append_unitary_1(cycle_actions, "H",
-                                x_qubits + ([] if is_gauge_z else gauge_data_qubits["X"]), ano_qubits)
+        cycle_params.append_unitary_1(cycle_actions, "H",
+                                      x_qubits + ([] if is_gauge_z else gauge_data_qubits["X"]), ano_qubits)
         cycle_actions.append("TICK")
-        params.append_measure(cycle_actions, stab_qubits["X"] + stab_qubits["Z"] +
-                              gauge_ancilla_qubits[gauge_basis] + gauge_data_qubits[gauge_basis])
+        cycle_params.append_measure(cycle_actions, stab_qubits["X"] + stab_qubits["Z"] +
+                                    gauge_ancilla_qubits[gauge_basis] + gauge_data_qubits[gauge_basis])
         if not is_gauge_z and gauge_data_qubits["X"]:
-            params.append_unitary_1(cycle_actions, "H", gauge_data_qubits["X"], ano_qubits)
+            cycle_params.append_unitary_1(cycle_actions, "H", gauge_data_qubits["X"], ano_qubits)
 
         record.measure([("X", "stab", qubit) for qubit in stab_qubits["X"]] +
                        [("Z", "stab", qubit) for qubit in stab_qubits["Z"]] +
@@ -92,62 +144,59 @@ def _generate_unshell_surface_code_circuit(params, logical_qubit, is_memory_z: b
         return cycle_actions
 
     def _generate_stab_detectors():
-        detectors = stim.Circuit()
+        rows = []
         for basis in "XZ":
-            for coord in logical_qubit.stabs[basis].keys():
-                detectors.append(
-                    "DETECTOR",
-                    [record.measure_rec((basis, "stab", p2q[coord]), -1),
-                     record.measure_rec((basis, "stab", p2q[coord]), -2)],
-                    coord + (0,)
-                )
-        return detectors
+            rows += np.stack([record.lookbacks(stab_ids[basis], -1),
+                              record.lookbacks(stab_ids[basis], -2)], axis=1).tolist()
+        return _instructions("DETECTOR", rows, stab_detector_coords["X"] + stab_detector_coords["Z"])
 
     def _generate_gauge_detectors(is_gauge_z):
-        detectors = stim.Circuit()
         basis = "XZ"[is_gauge_z]
-        for super_stab in logical_qubit.super_stabs[basis]:
-            detectors.append(
-                "DETECTOR",
-                [record.measure_rec((basis, "gauge", p2q[coord]), -1) for coord in super_stab] +
-                [record.measure_rec((basis, "gauge", p2q[coord]), -2) for coord in super_stab],
-                (-1, -1, 0)
-            )
-        return detectors
+        lengths = super_stab_lengths[basis]
+        rows = [last + previous for last, previous in
+                zip(_split(record.lookbacks(super_stab_ids[basis], -1), lengths),
+                    _split(record.lookbacks(super_stab_ids[basis], -2), lengths))]
+        return _instructions("DETECTOR", rows, [(-1, -1, 0)] * len(rows))
 
     # Build the start of the circuit, getting a state that's ready to cycle.
     # In particular, the first cycle has different detectors and so has to be handled special.
     head = stim.Circuit()
-    for p, q in sorted(p2q.items(), key=lambda item: item[1]):
-        head.append("QUBIT_COORDS", q, p)
+    qubits = arrays.qubits.tolist()
+    head += _instructions("QUBIT_COORDS", [[q] for q in qubits], [qubit_table.coords[q] for q in qubits], "%d")
     params.append_reset(head, data_qubits, chosen_basis)
-    head += _generate_cycle_actions(is_memory_z)
-    for coord in logical_qubit.stabs[chosen_basis].keys():
-        head.append(
-            "DETECTOR",
-            [record.measure_rec((chosen_basis, "stab", p2q[coord]), -1)],
-            coord + (0,)
-        )
-    for super_stab in logical_qubit.super_stabs[chosen_basis]:
-        head.append(
-            "DETECTOR",
-            [record.measure_rec((chosen_basis, "gauge", p2q[coord]), -1) for coord in super_stab],
-            (-1, -1, 0)
-        )
-    head += _generate_cycle_actions(not is_memory_z)
+    _, first_params = _round_params(0)
+    head += _generate_cycle_actions(is_memory_z, first_params)
+    head += _instructions("DETECTOR", record.lookbacks(stab_ids[chosen_basis], -1).reshape(-1, 1).tolist(),
+                          stab_detector_coords[chosen_basis])
+    head += _instructions("DETECTOR", _split(record.lookbacks(super_stab_ids[chosen_basis], -1),
+                                             super_stab_lengths[chosen_basis]),
+                          [(-1, -1, 0)] * len(super_stab_lengths[chosen_basis]))
+    head += _generate_cycle_actions(not is_memory_z, first_params)
     head.append("SHIFT_COORDS", [], (0, 0, 1))
     head += _generate_stab_detectors()
 
     # Build the repeated body of the circuit, including the detectors comparing to previous cycles.
-    body = stim.Circuit()
-    body += _generate_cycle_actions(is_memory_z)
-    body.append("SHIFT_COORDS", [], (0, 0, 1))
-    body += _generate_stab_detectors()
-    body += _generate_gauge_detectors(is_memory_z)
-    body += _generate_cycle_actions(not is_memory_z)
-    body.append("SHIFT_COORDS", [], (0, 0, 1))
-    body += _generate_stab_detectors()
-    body += _generate_gauge_detectors(not is_memory_z)
+    def _generate_body(body_params):
+        body = stim.Circuit()
+        body += _generate_cycle_actions(is_memory_z, body_params)
+        body.append("SHIFT_COORDS", [], (0, 0, 1))
+        body += _generate_stab_detectors()
+        body += _generate_gauge_detectors(is_memory_z)
+        body += _generate_cycle_actions(not is_memory_z, body_params)
+        body.append("SHIFT_COORDS", [], (0, 0, 1))
+        body += _generate_stab_detectors()
+        body += _generate_gauge_detectors(not is_memory_z)
+        return body
+
+    # The rounds after the first are cut into runs of rounds with the same burst events, each repeating one body.
+    runs = []
+    for round_index in range(1, params.rounds):
+        key, body_params = _round_params(round_index)
+        if runs and runs[-1][0] == key:
+            runs[-1][2] += 1
+        else:
+            runs.append([key, body_params, 1])
+    bodies = [_generate_body(body_params) * count for key, body_params, count in runs]
 
     # Build the end of the circuit, getting out of the cycle state and terminating.
     # In particular, the data measurements create detectors that have to be handled special.
@@ -155,38 +204,48 @@ def _generate_unshell_surface_code_circuit(params, logical_qubit, is_memory_z: b
     tail = stim.Circuit()
     params.append_measure(tail, data_qubits, chosen_basis)
     record.measure([(chosen_basis, "data", qubit) for qubit in data_qubits])
+
+    def _data_lookbacks(qubits):
+        return record.lookbacks(record.key_ids([(chosen_basis, "data", q) for q in qubits.tolist()]), -1)
+
     # Detectors.
-    for coord, acting_coords in logical_qubit.stabs[chosen_basis].items():
-        tail.append(
-            "DETECTOR",
-            [record.measure_rec((chosen_basis, "data", p2q[act_coord]), -1) for act_coord in acting_coords] +
-            [record.measure_rec((chosen_basis, "stab", p2q[coord]), -1)],
-            coord + (1,)
-        )
-    for super_stab in logical_qubit.super_stabs[chosen_basis]:
-        detector = []
-        for coord in super_stab:
-            for act_coord in logical_qubit.gauges[chosen_basis][coord]:
-                detector.append(record.measure_rec((chosen_basis, "data", p2q[act_coord]), -1))
-        detector += [record.measure_rec((chosen_basis, "gauge", p2q[coord]), -1) for coord in super_stab]
-        tail.append("DETECTOR", detector, (-1, -1, 1))
+    indptr, support = arrays.supports["stab"][chosen_basis]
+    data_rows = _split(_data_lookbacks(support), np.diff(indptr))
+    stab_rows = record.lookbacks(stab_ids[chosen_basis], -1).tolist()
+    tail += _instructions("DETECTOR", [data_row + [stab_row] for data_row, stab_row in zip(data_rows, stab_rows)],
+                          [coord[:2] + (1,) for coord in stab_detector_coords[chosen_basis]])
+    # the supports of the gauges of the super-stabilizers, one after the other
+    indptr, support = arrays.supports["gauge"][chosen_basis]
+    row = np.zeros(len(qubit_table), dtype=np.int64)
+    row[arrays.measurements["gauge"][chosen_basis]] = np.arange(len(indptr) - 1)
+    rows = row[arrays.super_stabs[chosen_basis][1]]
+    lengths = indptr[rows + 1] - indptr[rows]
+    ends = np.cumsum(lengths)
+    gauge_support = support[np.repeat(indptr[rows] - ends + lengths, lengths) + np.arange(ends[-1] if len(ends) else 0)]
+    # the data qubits of a super-stabilizer are the supports of its gauges
+    super_stab_starts = arrays.super_stabs[chosen_basis][0][:-1]
+    data_rows = _split(_data_lookbacks(gauge_support), np.add.reduceat(lengths, super_stab_starts) if len(rows) else [])
+    gauge_rows = _split(record.lookbacks(super_stab_ids[chosen_basis], -1), super_stab_lengths[chosen_basis])
+    tail += _instructions("DETECTOR", [data_row + gauge_row for data_row, gauge_row in zip(data_rows, gauge_rows)],
+                          [(-1, -1, 1)] * len(gauge_rows))
     # Logical observable
-    tail.append(
-        "OBSERVABLE_INCLUDE",
-        [record.measure_rec((chosen_basis, "data", p2q[coord]), -1) for coord in logical_qubit.observable[chosen_basis]],
-        0)
+    tail += _instructions("OBSERVABLE_INCLUDE", [_data_lookbacks(arrays.observable[chosen_basis]).tolist()], [(0,)])
 
     # Combine to form final circuit.
-    full_circuit = head + body * (params.rounds - 1) + tail
+    full_circuit = head
+    for body in bodies:
+        full_circuit += body
+    full_circuit += tail
     return full_circuit
 
 
-def generate_surface_code_circuit(params, logical_qubit, is_shell, is_memory_z):
+def generate_surface_code_circuit(params, logical_qubit, is_shell, is_memory_z, burst_events=()):
+    # burst_events lists the BurstEvent of the memory experiment, on top of the bursts of logical_qubit.ano_coords
     if is_shell:
         pass
         # return _generate_shell_surface_code_circuit(params, logical_qubit, is_memory_x)
     else:
-        return _generate_unshell_surface_code_circuit(params, logical_qubit, is_memory_z)
+        return _generate_unshell_surface_code_circuit(params, logical_qubit, is_memory_z, burst_events)
 
 
 if __name__ == "__main__":
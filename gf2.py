@@ -0,0 +1,32 @@
+import numpy as np
+
+
+def support_row(support, qubit_index) -> int:
+    # Pack a set of qubit coordinates into a bit row, bit qubit_index[q] standing for qubit q
+    row = 0
+    for q in support:
+        row |= 1 << qubit_index[q]
+    return row
+
+
+def anti_commute_rows(row1: int, row2: int) -> bool:
+    return (row1 & row2).bit_count() & 1 == 1
+
+
+def rows_to_array(rows, num_bits):
+    # Unpack bit rows into a (len(rows), num_bits) 0/1 matrix
+    num_bytes = (num_bits + 7) // 8
+    packed = np.frombuffer(b"".join(row.to_bytes(num_bytes, "little") for row in rows), dtype=np.uint8)
+    return np.unpackbits(packed.reshape(len(rows), num_bytes), axis=1, count=num_bits, bitorder="little")
+
+
+def anti_commutation_table(rows1, rows2, num_bits):
+    # table[i][j] is True iff rows1[i] and rows2[j] overlap on an odd number of qubits.
+    # The overlaps of all pairs come from a single matrix product over the unpacked rows.
+    if not rows1 or not rows2:
+        return np.zeros((len(rows1), len(rows2)), dtype=bool)
+    # float32 products are exact as long as the overlaps stay below 2 ** 24
+    matrix1 = rows_to_array(rows1, num_bits).astype(np.float32)
+    matrix2 = rows_to_array(rows2, num_bits).astype(np.float32)
+    overlaps = matrix1 @ matrix2.T
+    return overlaps.astype(np.int64) % 2 == 1
@@ -0,0 +1,169 @@
+from code_deformation import LogicalQubit
+from multiprocessing import shared_memory
+import json
+import mmap
+import numpy as np
+import struct
+
+# Binary records of deformed patches. A record is a header (magic, FORMAT_VERSION, length of the JSON table of
+# contents, length of the record), the table of contents {name: [dtype, length, offset]} and the arrays it lists,
+# each aligned to 8 bytes. Qubits are stored by their ids in the QubitTable of the patch. Records can be concatenated
+# in one file or shared memory block, and PatchRecord reads one as NumPy views of the buffer, without copying it.
+MAGIC = b"CDPATCH\0"
+# Bump when the layout of the arrays changes
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<8sIIQ")
+ALIGNMENT = 8
+
+
+def _ragged(items):
+    # (keys, indptr, values) of the (key, row) items, row i being values[indptr[i]:indptr[i + 1]]
+    indptr = np.zeros(len(items) + 1, dtype=np.int64)
+    np.cumsum([len(row) for key, row in items], out=indptr[1:])
+    return [key for key, row in items], indptr, [value for key, row in items for value in row]
+
+
+def _arrays(logical_qubit):
+    # {name: array} of a patch, following the order of state() so that the patch is built back exactly
+    if not logical_qubit.is_rotated:
+        raise ValueError("Only rotated patches have a qubit table.")
+    state = logical_qubit.state()
+    ids = logical_qubit.qubit_table.ids
+    arrays = {"meta": np.array([state["size"], state["distance"]["X"], state["distance"]["Z"]], dtype=np.int64)}
+    for basis in "XZ":
+        for kind in ("stabs", "gauges"):
+            keys, indptr, values = _ragged(state[kind][basis])
+            arrays["%s_%s" % (kind, basis)] = np.array(ids(keys), dtype=np.int32)
+            arrays["%s_%s_indptr" % (kind, basis)] = indptr
+            arrays["%s_%s_support" % (kind, basis)] = np.array(ids(values), dtype=np.int32)
+        keys, indptr, values = _ragged(state["super_stabs"][basis])
+        arrays["super_stabs_%s" % basis] = np.array(keys, dtype=np.int64)
+        arrays["super_stabs_%s_indptr" % basis] = indptr
+        arrays["super_stabs_%s_gauges" % basis] = np.array(ids(values), dtype=np.int32)
+        arrays["observable_%s" % basis] = np.array(ids(state["observable"][basis]), dtype=np.int32)
+        for i, edge in enumerate(state["edges"][basis]):
+            arrays["edges_%s_%d" % (basis, i)] = np.array(ids(edge), dtype=np.int32)
+    arrays["corners"] = np.array([-1 if coord is None else logical_qubit.qubit_table.id(tuple(coord))
+                                  for row in state["corners"] for coord in row], dtype=np.int32)
+    for name in ("data_coords", "qubit_coords", "ano_coords", "defect_coords"):
+        arrays[name] = np.array(ids(state[name]), dtype=np.int32)
+    return arrays
+
+
+def encode(logical_qubit):
+    # bytes of the record of a patch
+    arrays = _arrays(logical_qubit)
+    contents, offset = {}, 0
+    for name, array in arrays.items():
+        contents[name] = [array.dtype.str, len(array), offset]
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+    text = json.dumps(contents, separators=(",", ":")).encode()
+    text += b" " * (-(HEADER.size + len(text)) % ALIGNMENT)
+    data = bytearray(HEADER.size + len(text) + offset)
+    HEADER.pack_into(data, 0, MAGIC, FORMAT_VERSION, len(text), len(data))
+    data[HEADER.size:HEADER.size + len(text)] = text
+    start = HEADER.size + len(text)
+    for name, array in arrays.items():
+        data[start + contents[name][2]:start + contents[name][2] + array.nbytes] = array.tobytes()
+    return bytes(data)
+
+
+class PatchRecord:
+    # Record of a patch at offset in buffer (bytes, mmap, shared memory buffer, ...). arrays[name] are read-only
+    # views of the buffer, which must stay open while they are in use. nbytes is the length of the record.
+    def __init__(self, buffer, offset=0):
+        magic, version, text_length, self.nbytes = HEADER.unpack_from(buffer, offset)
+        if magic != MAGIC:
+            raise ValueError("Not a patch record at offset %d." % offset)
+        if version != FORMAT_VERSION:
+            raise ValueError("Patch record of format version %d, expected %d." % (version, FORMAT_VERSION))
+        start = offset + HEADER.size
+        contents = json.loads(bytes(buffer[start:start + text_length]))
+        start += text_length
+        self.arrays = {name: np.frombuffer(buffer, dtype=np.dtype(dtype), count=length, offset=start + array_offset)
+                       for name, (dtype, length, array_offset) in contents.items()}
+        self.size = int(self.arrays["meta"][0])
+
+    def coords(self, ids):
+        # coordinates of qubit ids, inverting the numbering of QubitTable
+        width = 2 * self.size + 1
+        ids = np.asarray(ids, dtype=np.int64)
+        xs = ids % width
+        return list(zip(xs.tolist(), (2 * (ids // width) + xs % 2).tolist()))
+
+    def _rows(self, name, values, keys):
+        indptr = self.arrays[name + "_indptr"].tolist()
+        values = self.coords(self.arrays[name + "_" + values])
+        return [(key, values[start:end]) for key, start, end in zip(keys, indptr, indptr[1:])]
+
+    def state(self):
+        # LogicalQubit.state() of the patch
+        arrays = self.arrays
+        return {
+            "size": self.size,
+            "is_rotated": True,
+            "distance": {"X": int(arrays["meta"][1]), "Z": int(arrays["meta"][2])},
+            "stabs": {basis: self._rows("stabs_" + basis, "support", self.coords(arrays["stabs_" + basis]))
+                      for basis in "XZ"},
+            "gauges": {basis: self._rows("gauges_" + basis, "support", self.coords(arrays["gauges_" + basis]))
+                       for basis in "XZ"},
+            "super_stabs": {basis: self._rows("super_stabs_" + basis, "gauges", arrays["super_stabs_" + basis].tolist())
+                            for basis in "XZ"},
+            "observable": {basis: self.coords(arrays["observable_" + basis]) for basis in "XZ"},
+            "edges": {basis: [self.coords(arrays["edges_%s_%d" % (basis, i)]) for i in range(2)] for basis in "XZ"},
+            "corners": [[None if q < 0 else self.coords([q])[0] for q in arrays["corners"][2 * i:2 * i + 2].tolist()]
+                        for i in range(2)],
+            "data_coords": self.coords(arrays["data_coords"]),
+            "qubit_coords": self.coords(arrays["qubit_coords"]),
+            "ano_coords": self.coords(arrays["ano_coords"]),
+            "defect_coords": self.coords(arrays["defect_coords"]),
+        }
+
+    def logical_qubit(self, check_mode="incremental", backend="set", split_mode="adaptive"):
+        return LogicalQubit.from_state(self.state(), check_mode, backend, split_mode)
+
+
+def records(buffer, length=None):
+    # PatchRecords of the records concatenated in the first length bytes of buffer (all of it by default)
+    length = len(buffer) if length is None else length
+    result, offset = [], 0
+    while offset < length:
+        result.append(PatchRecord(buffer, offset))
+        offset += result[-1].nbytes
+    return result
+
+
+def save(path, logical_qubits):
+    with open(path, "wb") as f:
+        for logical_qubit in logical_qubits:
+            f.write(encode(logical_qubit))
+
+
+def load(path):
+    # PatchRecords of a file written by save(), reading the arrays from a memory map of the file
+    with open(path, "rb") as f:
+        if not f.seek(0, 2):
+            return []
+        return records(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def share(logical_qubits, name=None):
+    # Shared memory block holding the records of the patches, for attach() in other processes. The caller closes
+    # and unlinks it once the workers are done.
+    data = b"".join(encode(logical_qubit) for logical_qubit in logical_qubits)
+    block = shared_memory.SharedMemory(name=name, create=True, size=max(len(data), 1))
+    block.buf[:len(data)] = data
+    # the block can be larger than asked for, a zero header marks the end of the records
+    block.buf[len(data):len(data) + HEADER.size] = bytes(min(HEADER.size, block.size - len(data)))
+    return block
+
+
+def attach(name):
+    # (block, PatchRecords) of a shared memory block made by share(). Keep the block while the records are in use,
+    # then drop the records before block.close().
+    block = shared_memory.SharedMemory(name=name)
+    result, offset = [], 0
+    while offset + HEADER.size <= block.size and HEADER.unpack_from(block.buf, offset)[0] == MAGIC:
+        result.append(PatchRecord(block.buf, offset))
+        offset += result[-1].nbytes
+    return block, result
@@ -0,0 +1,93 @@
+from circuit_gen_params import CircuitGenParameters
+from circuit_template import CircuitTemplate
+from dem_cache import DemCache
+from defect_ensemble import configuration_defects, deform
+import argparse
+import os
+import sinter
+import sys
+
+
+def sweep_tasks(distances, noises, bases, num_maps, data_rate, ancilla_rate, seed=0, rounds=None, dem_cache=None,
+                skipped=None):
+    # sinter tasks of the memory experiments over distances x defect maps x noises x bases. Map index of a distance
+    # is the configuration index of defect_ensemble with the same rates and seed, and rounds defaults to the
+    # distance. The circuits of a (patch, basis) come from one CircuitTemplate. Maps the deformation fails on are
+    # skipped, and appended to the list skipped as {"d", "map", "defects", "error"} if it is given.
+    for distance in distances:
+        num_rounds = rounds or distance
+        for index in range(num_maps):
+            defects = configuration_defects(distance, data_rate, ancilla_rate, seed, index)
+            try:
+                logical_qubit = deform(distance, defects)
+            except Exception as e:
+                if skipped is not None:
+                    skipped.append({"d": distance, "map": index, "defects": [list(coord) for coord in defects],
+                                    "error": repr(e)})
+                continue
+            for basis in bases:
+                template = CircuitTemplate(logical_qubit, num_rounds, basis == "Z")
+                for p in noises:
+                    circuit = template.circuit(CircuitGenParameters(num_rounds, p, p, p, p))
+                    yield sinter.Task(
+                        circuit=circuit,
+                        detector_error_model=None if dem_cache is None else dem_cache.detector_error_model(circuit),
+                        json_metadata={
+                            "d": distance,
+                            "map": index,
+                            # in the order they were disabled, which the deformed patch depends on
+                            "defects": [list(coord) for coord in defects],
+                            "distance_x": logical_qubit.distance["X"],
+                            "distance_z": logical_qubit.distance["Z"],
+                            "p": p,
+                            "basis": basis,
+                            "rounds": num_rounds,
+                        },
+                    )
+
+
+def run_sweep(tasks, path, max_shots, max_errors, num_workers=None, decoder="pymatching"):
+    # Sample the tasks on all cores. The statistics are appended to the CSV file at path as they come in, and a run
+    # on the same path resumes from them instead of sampling the finished shots again.
+    return sinter.collect(
+        num_workers=num_workers or os.cpu_count(),
+        tasks=tasks,
+        decoders=[decoder],
+        max_shots=max_shots,
+        max_errors=max_errors,
+        save_resume_filepath=path,
+        print_progress=True,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sample memory experiments of randomly deformed surface codes.")
+    parser.add_argument("--distances", type=int, nargs="+", required=True)
+    parser.add_argument("--noise", type=float, nargs="+", required=True)
+    parser.add_argument("--bases", nargs="+", choices=["X", "Z"], default=["X", "Z"])
+    parser.add_argument("--maps", type=int, default=1, help="defect maps per distance")
+    parser.add_argument("--data-rate", type=float, default=0.0)
+    parser.add_argument("--ancilla-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--rounds", type=int, default=None, help="rounds of each experiment, the distance if unset")
+    parser.add_argument("--max-shots", type=int, default=10 ** 6)
+    parser.add_argument("--max-errors", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--decoder", default="pymatching")
+    parser.add_argument("--dem-cache", default=None, help="directory of cached detector error models")
+    parser.add_argument("--csv", required=True, help="resumable output file")
+    args = parser.parse_args(argv)
+
+    dem_cache = None if args.dem_cache is None else DemCache(args.dem_cache)
+    skipped = []
+    tasks = sweep_tasks(args.distances, args.noise, args.bases, args.maps, args.data_rate, args.ancilla_rate,
+                        args.seed, args.rounds, dem_cache, skipped)
+    run_sweep(tasks, args.csv, args.max_shots, args.max_errors, args.workers, args.decoder)
+    if skipped:
+        print("Skipped %d defect maps the deformation failed on:" % len(skipped), file=sys.stderr)
+        for entry in skipped:
+            print("  d=%d map=%d: %s" % (entry["d"], entry["map"], entry["error"]), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+from circuit_gen_params import BurstEvent, CircuitGenParameters, exponential_profile
+from code_deformation import LogicalQubit
+from gen_surface_code_ver3 import generate_surface_code_circuit
+import pytest
+
+
+def depolarization_layers(circuit):
+    # [{qubit: depolarization}] of the noise between consecutive TICKs of the flattened circuit
+    layers = [{}]
+    for instruction in circuit.flattened():
+        if instruction.name == "TICK":
+            layers.append({})
+        elif instruction.name.startswith("DEPOLARIZE"):
+            for target in instruction.targets_copy():
+                layers[-1][target.value] = max(layers[-1].get(target.value, 0), instruction.gate_args_copy()[0])
+    return layers
+
+
+def test_exponential_profile_stops_at_base_rate():
+    profile = exponential_profile(0.3, 10, 1e-3)
+    assert profile and all(p > 1e-3 for p in profile)
+    assert profile == sorted(profile, reverse=True)
+
+
+@pytest.mark.parametrize("profile", [exponential_profile(0.3, 2, 1e-3), [1e-5] * 4, [0.01] * 4])
+def test_burst_events_never_lower_noise(profile):
+    p = 1e-3
+    params = CircuitGenParameters(8, p, p, p, p)
+    logical_qubit = LogicalQubit(5, True)
+    logical_qubit.burst_error((5, 5), 1)
+    base = depolarization_layers(generate_surface_code_circuit(params, logical_qubit, False, True))
+    events = depolarization_layers(generate_surface_code_circuit(params, logical_qubit, False, True,
+                                                                 [BurstEvent((5, 5), 1.5, 2, profile)]))
+    assert len(events) == len(base)
+    for layer, base_layer in zip(events, base):
+        assert layer.keys() == base_layer.keys()
+        assert all(layer[q] >= rate for q, rate in base_layer.items())
+    assert any(rate == params.burst_errors_depolarization for layer in events for rate in layer.values())
@@ -0,0 +1,123 @@
+from code_deformation import LogicalQubit
+import hashlib
+import json
+import os
+import pytest
+import random
+
+# (distance, defect rate, seed) of the random defect maps, from sparse to dense. baseline_deformations.json lists
+# [distance, rate, seed, distance X, distance Z, digest()] of the patch the original engine (code_deformation.py of
+# the first commit) makes of each, or a null distance and the name of the exception it raised
+BASELINE_MAPS = [(d, rate, 1000 * k + d) for k in range(4) for d in (5, 7, 9, 11, 13)
+                 for rate in (0.05, 0.1, 0.15, 0.2, 0.25, 0.3)]
+# Modes of the engine, which must all give the patches of the original engine
+MODES = [{}, {"check_mode": "sweep", "split_mode": "always"}, {"check_mode": "verify", "split_mode": "verify"},
+         {"backend": "bits"}]
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline_deformations.json")) as f:
+    BASELINE = {tuple(row[:3]): row[3:] for row in json.load(f)}
+
+
+def random_defects(distance, rate, seed):
+    # Each qubit of the undeformed patch is a defect with probability rate, in a random order
+    rng = random.Random(seed)
+    defects = [q for q in sorted(LogicalQubit(distance, True).qubit_coords) if rng.random() < rate]
+    rng.shuffle(defects)
+    return defects
+
+
+def digest(logical_qubit):
+    # sha256 of the measurements and super-stabilizers in the order of their dicts (lists in the original engine),
+    # the logical operators and the data qubits
+    def super_stabs(basis):
+        gauge_coords = logical_qubit.super_stabs[basis]
+        return list(gauge_coords.values()) if isinstance(gauge_coords, dict) else gauge_coords
+
+    content = [[[[coord, sorted(support)] for coord, support in measurements[basis].items()]
+                for measurements in (logical_qubit.stabs, logical_qubit.gauges)] +
+               [[sorted(gauge_coords) for gauge_coords in super_stabs(basis)],
+                sorted(logical_qubit.observable[basis]),
+                [sorted(edge) for edge in logical_qubit.edges[basis]]] for basis in "XZ"]
+    content += [logical_qubit.corners, sorted(logical_qubit.data_coords)]
+    return hashlib.sha256(json.dumps(content).encode()).hexdigest()
+
+
+def deform(distance, defects, **modes):
+    logical_qubit = LogicalQubit(distance, True, **modes)
+    for coord in defects:
+        logical_qubit.disable(coord)
+    logical_qubit.update_distance()
+    return logical_qubit
+
+
+@pytest.mark.parametrize("distance, rate, seed", [(11, 0.3, seed) for seed in range(6)])
+def test_split_replay_matches_sweeps_on_dense_maps(distance, rate, seed):
+    # "verify" runs the sweeps of every super-stabilizer and asserts the replays of "adaptive" would agree
+    defects = random_defects(distance, rate, seed)
+    always = deform(distance, defects, split_mode="always")
+    for split_mode in ("adaptive", "verify"):
+        logical_qubit = deform(distance, defects, check_mode="verify", split_mode=split_mode)
+        assert logical_qubit.state() == always.state()
+        for basis in "XZ":
+            assert [list(gauge_coords) for gauge_coords in logical_qubit.super_stabs[basis].values()] == \
+                   [list(gauge_coords) for gauge_coords in always.super_stabs[basis].values()]
+
+
+@pytest.mark.parametrize("modes", MODES)
+@pytest.mark.parametrize("distance, rate, seed", BASELINE_MAPS)
+def test_deformation_matches_baseline(distance, rate, seed, modes):
+    distance_x, distance_z, expected = BASELINE[distance, rate, seed]
+    defects = random_defects(distance, rate, seed)
+    if distance_x is None:
+        with pytest.raises(Exception) as error:
+            deform(distance, defects, **modes)
+        assert type(error.value).__name__ == expected
+        return
+    logical_qubit = deform(distance, defects, **modes)
+    assert (logical_qubit.distance["X"], logical_qubit.distance["Z"]) == (distance_x, distance_z)
+    assert digest(logical_qubit) == expected
+
+
+@pytest.mark.parametrize("distance, rate, seed", BASELINE_MAPS)
+def test_fork_continues_like_the_original(distance, rate, seed):
+    defects = random_defects(distance, rate, seed)
+    logical_qubit = LogicalQubit(distance, True)
+    logical_qubit.burst_error((distance, distance), 1)
+    for coord in defects[:len(defects) // 2]:
+        logical_qubit.disable(coord)
+    logical_qubit.update_distance()
+    logical_qubit.burst_errors([(1, 1), (2 * distance - 1, 1)], 1.5)
+    fork = logical_qubit.fork()
+    assert fork.state() == logical_qubit.state()
+    for patch in (logical_qubit, fork):
+        for coord in defects[len(defects) // 2:]:
+            patch.disable(coord)
+        patch.update_distance()
+    assert digest(fork) == digest(logical_qubit)
+    assert fork.distance == logical_qubit.distance
+    assert fork.ano_coords == logical_qubit.ano_coords
+
+
+@pytest.mark.parametrize("distance, rate, seed", BASELINE_MAPS)
+def test_rollback_then_continue_matches_a_fresh_patch(distance, rate, seed):
+    defects = random_defects(distance, rate, seed)
+    common, rest = defects[:len(defects) // 2], defects[len(defects) // 2:][::-1]
+    logical_qubit = LogicalQubit(distance, True)
+    for coord in common:
+        logical_qubit.disable(coord)
+    savepoint = logical_qubit.savepoint()
+    for coord in defects[len(common):]:
+        logical_qubit.disable(coord)
+    logical_qubit.update_distance()
+    logical_qubit.rollback(savepoint)
+    for coord in rest:
+        logical_qubit.disable(coord)
+    logical_qubit.update_distance()
+    fresh = deform(distance, common + rest)
+    assert digest(logical_qubit) == digest(fresh)
+    assert logical_qubit.distance == fresh.distance
+    if rest:
+        logical_qubit.enable(rest[0])
+        logical_qubit.update_distance()
+        fresh = deform(distance, common + rest[1:])
+        assert digest(logical_qubit) == digest(fresh)
+        assert logical_qubit.distance == fresh.distance
@@ -0,0 +1,16 @@
+from deformation_cache import DeformationCache
+from test_code_deformation import deform, digest, random_defects
+
+
+def test_defect_orders_share_the_entry_of_the_sorted_defects(tmp_path):
+    defects = random_defects(9, 0.15, 9)
+    cache = DeformationCache(str(tmp_path))
+    first = cache.deform(9, defects)
+    second = cache.deform(9, defects[::-1] + defects[:1])
+    assert (cache.misses, cache.hits) == (1, 1)
+    expected = deform(9, sorted(defects))
+    for logical_qubit in (first, second):
+        assert digest(logical_qubit) == digest(expected)
+        assert logical_qubit.distance == expected.distance
+    from_disk = DeformationCache(str(tmp_path)).deform(9, defects)
+    assert digest(from_disk) == digest(expected)
@@ -0,0 +1,35 @@
+import pytest
+
+sinter = pytest.importorskip("sinter")
+import sinter_sweep
+
+
+def test_sweep_tasks_cover_the_grid():
+    tasks = list(sinter_sweep.sweep_tasks([3, 5], [1e-3, 2e-3], ["X", "Z"], 2, 0.05, 0.05, seed=1))
+    assert len(tasks) == 2 * 2 * 2 * 2
+    assert {(task.json_metadata["d"], task.json_metadata["map"], task.json_metadata["p"], task.json_metadata["basis"])
+            for task in tasks} == {(d, index, p, basis) for d in (3, 5) for index in range(2) for p in (1e-3, 2e-3)
+                                   for basis in "XZ"}
+    for task in tasks:
+        metadata = task.json_metadata
+        logical_qubit = sinter_sweep.deform(metadata["d"], [tuple(coord) for coord in metadata["defects"]])
+        assert (metadata["distance_x"], metadata["distance_z"]) == (logical_qubit.distance["X"],
+                                                                    logical_qubit.distance["Z"])
+        assert metadata["rounds"] == metadata["d"]
+        assert task.circuit.num_observables == 1
+
+
+def test_sweep_tasks_report_skipped_maps(monkeypatch):
+    deform = sinter_sweep.deform
+
+    def failing_deform(distance, defects):
+        if distance == 5:
+            raise ValueError("deformation failed")
+        return deform(distance, defects)
+
+    monkeypatch.setattr(sinter_sweep, "deform", failing_deform)
+    skipped = []
+    tasks = list(sinter_sweep.sweep_tasks([3, 5], [1e-3], ["Z"], 2, 0.05, 0.05, skipped=skipped))
+    assert [task.json_metadata["d"] for task in tasks] == [3, 3]
+    assert [(entry["d"], entry["map"]) for entry in skipped] == [(5, 0), (5, 1)]
+    assert all("deformation failed" in entry["error"] for entry in skipped)